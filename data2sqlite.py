@@ -18,7 +18,15 @@ argparser.add_argument('-t', '--target', default='dump.db',
 argparser.add_argument('--init', action='store_true',                           help='If set, existing files will be purged')
 argparser.add_argument('--name', default='source',                              help='NAME in target db (required, default: "source")')
 argparser.add_argument('--dump_mysql',                                          help='If set, output in mysql sql format, use "-" to dump to STDOUT')
+argparser.add_argument('--dump_mysql_packet_size', type=int, default=1024*1024,   help='Longest statement written by --dump_mysql, keep below max_allowed_packet (Default: 1048576)')
+argparser.add_argument('--dump_mysql_parallel', type=int, default=None,         help='If set, --dump_mysql is a directory, N worker processes write one file per table')
 argparser.add_argument('-s', '--silent', action='store_true',                   help="If set, don't output progress every 100 rows.")
+argparser.add_argument('--resume', action='store_true',                         help='If set, skip the tables finished by an interrupted run and continue partial tables after their last checkpoint')
+argparser.add_argument('--pagination', default='keyset', choices=['keyset', 'offset'], help='Paging through origin tables, "keyset" falls back to "offset" for tables without primary key (Default: keyset)')
+argparser.add_argument('--buffer_size', type=int, default=10000,                help='Rows written to the target per insert batch and transaction (Default: 10000)')
+argparser.add_argument('--bulk_load', action='store_true',                      help='If set, write the target without syncing and create its indexes after the tables are loaded, then run ANALYZE')
+argparser.add_argument('--report',                                              help='If set, write a json report with rows/s, bytes and fetch, conversion and insert times of every table and EAS batch to this file')
+argparser.add_argument('--filestore_dir',                                        help='If set, file data is written to this directory next to the target (content addressed) instead of into the target')
 
 subparsers=argparser.add_subparsers(help="Set Datasources", dest='mode')
 
@@ -30,11 +38,22 @@ migration_parser.add_argument('--eas_url',
 migration_parser.add_argument('--eas_instance',                                 help='Instance-Name on EAS-Server')
 migration_parser.add_argument('--eas_versions',  nargs='*',                     help='Asset Version and Storage-Method, enter "version:method", e.g "original:url"')
 migration_parser.add_argument('--schema', default='public',                     help='Schema for pg-database, default = "public". Set to "none" to not use a schema.')
+migration_parser.add_argument('--parallel', type=int, default=None,             help='Number of pg tables copied at once, all workers share one snapshot')
+migration_parser.add_argument('--reader', default='cursor', choices=['cursor', 'copy'], help='Read pg tables with a cursor or stream them with COPY (Default: cursor)')
+migration_parser.add_argument('--itersize', type=int, default=None,             help='Rows per fetch of the server side pg cursors (Default: 2000)')
+migration_parser.add_argument('--schema_cache', default=None,                   help='Directory to cache the pg schema in, reused until tables, columns or indexes change')
+migration_parser.add_argument('--eas_parallel', type=int, default=None,         help='Number of EAS files downloaded at once')
 
 pg_parser=subparsers.add_parser('pg', help="Add to Source from postgres")
 pg_parser.add_argument('--dsn',                                                 help='DSN for PostgreSQL,format: "dbname=easydb port=5432 user=postgres"')
 pg_parser.add_argument('--schema', default='public',                            help='Schema for pg-database, default = "public"')
 pg_parser.add_argument('--tables', nargs='*', default=[],                       help='Select Tables for Export from postgresql')
+pg_parser.add_argument('--parallel', type=int, default=None,                    help='Number of tables copied at once, all workers share one snapshot')
+pg_parser.add_argument('--reader', default='cursor', choices=['cursor', 'copy'], help='Read tables with a cursor or stream them with COPY (Default: cursor)')
+pg_parser.add_argument('--itersize', type=int, default=None,                    help='Rows per fetch of the server side cursors (Default: 2000)')
+pg_parser.add_argument('--schema_cache', default=None,                          help='Directory to cache the schema in, reused until tables, columns or indexes change')
+pg_parser.add_argument('--incremental', action='store_true',                    help='If set, copy only rows changed since the last incremental run into the existing tables and remove deleted rows')
+pg_parser.add_argument('--change_column', default=None,                         help='With --incremental, tables having this column are compared against its maximum instead of xmin')
 
 mysql_parser=subparsers.add_parser('mysql', help="Add to Source from mySQL")
 mysql_parser.add_argument('--host',                                                help='mySQL host')
@@ -42,16 +61,25 @@ mysql_parser.add_argument('--dbname',
 mysql_parser.add_argument('--username',                                            help='Username for mySQL-DB')
 mysql_parser.add_argument('--password', default='',                                help='PW for mySQL-User')
 mysql_parser.add_argument('--tables', nargs='*', default=[],                       help='Select Tables for Export from postgresql')
+mysql_parser.add_argument('--parallel', type=int, default=None,                    help='Number of tables copied at once')
+mysql_parser.add_argument('--schema_cache', default=None,                          help='Directory to cache the schema in, reused until tables, columns or primary keys change')
 
 import_parser=subparsers.add_parser('file', help="Add to Source from other files")
 import_parser.add_argument('--sqlite', nargs='*', default=[],                   help='Filename for SQLite Database')
 import_parser.add_argument('--XML', nargs='*', default=[],                      help='Filename(s) for XML')
 import_parser.add_argument('--CSV', nargs='*', default=[],                      help='Filename(s) for CSV')
 import_parser.add_argument('--XLSX', nargs='*', default=[],                     help='Filename(s) for Excel (Supported formats are .xlsx, .xlsm, .xltx, .xltm)')
+import_parser.add_argument('--prescan', action='store_true',                    help='Scan all XML files for their columns before the import, the columns are added at once')
+import_parser.add_argument('--parallel', type=int, default=None,                help='Number of worker processes parsing XML files, excel sheets and ranges of CSV files')
+import_parser.add_argument('--infer_types', action='store_true',                help='Use INTEGER and REAL for CSV columns, if all values can be stored without change')
+import_parser.add_argument('--XML_records', nargs='*', default=[],              help='Filename(s) for XML imported by record, see --record_path')
+import_parser.add_argument('--record_path', default=None,                       help='Path of the record elements, e.g. /export/objects/object')
+import_parser.add_argument('--record_columns', nargs='*', default=[],           help='Columns of the records as NAME=PATH or NAME:TYPE=PATH, e.g. id=@id title=title')
 
 import_parser=subparsers.add_parser('adhh', help="Add to Source from ADHH XML files")
 import_parser.add_argument('--sqlite', nargs='*', default=[],                   help='Filename for SQLite Database')
 import_parser.add_argument('--xml', nargs='*', default=[],                      help='Filename(s) for ADHH XML')
+import_parser.add_argument('--prescan', action='store_true',                    help='Scan XML files for their columns before the import')
 
 global args
 
@@ -59,9 +87,10 @@ args = argparser.parse_args()
 
 extract.__pg_init()
 extract.__sqlite_init()
-extract.prepare_source(args.target, init=args.init)
+extract.prepare_source(args.target, init=args.init, external_filestore=args.filestore_dir, bulk_load=args.bulk_load, report=args.report)
 
 extract.args = args
+extract.bulk_buffer_size = args.buffer_size
 
 ##MIGRATION#####################################################################
 if args.mode=="easydb4":
@@ -151,6 +180,8 @@ if args.mode=="easydb4":
     logging.info("Adding to Source from sqlite")
     extract.sqlite_to_source(
         name=name,
+        pagination=args.pagination,
+        resume=args.resume,
         filename=sqlite_file
         )
 
@@ -162,6 +193,12 @@ if args.mode=="easydb4":
     logging.info("Adding to Source from pg")
     extract.pg_to_source(
         name=name,
+        pagination=args.pagination,
+        resume=args.resume,
+        parallel=args.parallel,
+        reader=args.reader,
+        itersize=args.itersize,
+        schema_cache=args.schema_cache,
         schema_name=schema,
         dsn=pg_dsn,
         include_tables_exclusive=False,
@@ -184,7 +221,8 @@ if args.mode=="easydb4":
             name=name,
             url=eas_url,
             instance=eas_instance,
-            eas_versions=eas_versions
+            eas_versions=eas_versions,
+            parallel=args.eas_parallel
             )
 
 ##PG############################################################################
@@ -198,6 +236,14 @@ if args.mode=="pg":
         if include_tables != {}:
             extract.pg_to_source(
                 name=args.name,
+                pagination=args.pagination,
+                resume=args.resume,
+                parallel=args.parallel,
+                reader=args.reader,
+                itersize=args.itersize,
+                incremental=args.incremental,
+                change_columns=args.change_column,
+                schema_cache=args.schema_cache,
                 schema_name=args.schema,
                 dsn=args.dsn,
                 include_tables_exclusive=True,
@@ -206,6 +252,14 @@ if args.mode=="pg":
         else:
             extract.pg_to_source(
                 name=args.name,
+                pagination=args.pagination,
+                resume=args.resume,
+                parallel=args.parallel,
+                reader=args.reader,
+                itersize=args.itersize,
+                incremental=args.incremental,
+                change_columns=args.change_column,
+                schema_cache=args.schema_cache,
                 schema_name=args.schema,
                 dsn=args.dsn,
                 include_tables_exclusive=False
@@ -224,6 +278,10 @@ if args.mode=="mysql":
         if include_tables != {}:
             extract.mysql_to_source(
                 name=args.name,
+                pagination=args.pagination,
+                resume=args.resume,
+                parallel=args.parallel,
+                schema_cache=args.schema_cache,
                 host=args.host,
                 db=args.dbname,
                 user=args.username,
@@ -234,6 +292,10 @@ if args.mode=="mysql":
         else:
             extract.mysql_to_source(
                 name=args.name,
+                pagination=args.pagination,
+                resume=args.resume,
+                parallel=args.parallel,
+                schema_cache=args.schema_cache,
                 host=args.host,
                 db=args.dbname,
                 user=args.username,
@@ -254,6 +316,8 @@ if args.mode=="file":
             logging.info("Adding sqlite to Source")
             extract.sqlite_to_source(
                 name=args.name,
+                pagination=args.pagination,
+                resume=args.resume,
                 filename=sqlite_file
                 )
 
@@ -278,13 +342,14 @@ if args.mode=="file":
         for elem in basedir_split:
             basedir+=(elem+"/")
 
-        for xml_file in args.XML:
-            logging.info("Adding XML to Source")
-            extract.xml_to_source(
-                name=args.name,
-                filename=xml_file,
-                basedir=basedir
-                )
+        logging.info("Adding XML to Source")
+        extract.xml_files_to_source(
+            name=args.name,
+            filenames=args.XML,
+            basedir=basedir,
+            prescan=args.prescan,
+            parallel=args.parallel
+            )
 
     if args.CSV !=[]:
         for csv_file in args.CSV:
@@ -292,6 +357,8 @@ if args.mode=="file":
             extract.csv_to_source(
                 name=args.name,
                 filename=csv_file,
+                infer_types=args.infer_types,
+                parallel=args.parallel
                 )
 
     if args.XLSX != []:
@@ -299,7 +366,30 @@ if args.mode=="file":
             logging.info("Adding XLSX to Source")
             extract.excel_to_source(
                 name=args.name,
-                filename=xlsx_file)
+                filename=xlsx_file,
+                parallel=args.parallel)
+
+    if args.XML_records != []:
+        if args.record_path is None or args.record_columns == []:
+            logging.warning('--XML_records needs --record_path and --record_columns. Program will terminate now')
+            sys.exit(0)
+
+        record_columns = []
+        for spec in args.record_columns:
+            (column_name, path) = spec.split("=", 1)
+            column = {"path": path}
+            if ":" in column_name:
+                (column_name, column["type"]) = column_name.split(":", 1)
+            column["name"] = column_name
+            record_columns.append(column)
+
+        for xml_file in args.XML_records:
+            logging.info("Adding XML records to Source")
+            extract.xml_records_to_source(
+                name=args.name,
+                filename=xml_file,
+                record_path=args.record_path,
+                columns=record_columns)
 
 ##ADHH-IMPORT##################################################################
 if args.mode=="adhh":
@@ -312,6 +402,8 @@ if args.mode=="adhh":
             logging.info("Adding sqlite '" + sqlite_file + "' to Source")
             extract.sqlite_to_source(
                 name=args.name,
+                pagination=args.pagination,
+                resume=args.resume,
                 filename=sqlite_file
                 )
 
@@ -341,12 +433,15 @@ if args.mode=="adhh":
             extract.adhh_xml_to_source(
                 name=args.name,
                 filename=xml_file,
-                basedir=basedir
+                basedir=basedir,
+                prescan=args.prescan
                 )
 
 
 if args.dump_mysql is not None:
     extract.dump_mysql(
-            output=args.dump_mysql
+            output=args.dump_mysql,
+            packet_size=args.dump_mysql_packet_size,
+            parallel=args.dump_mysql_parallel
             )
 extract.__commit_source()
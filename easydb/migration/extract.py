@@ -13,6 +13,7 @@ import sys
 import decimal
 import json
 import MySQLdb
+import MySQLdb.cursors
 import requests
 import chardet
 import csv
@@ -20,8 +21,100 @@ import xml.parsers.expat
 import xml.etree.ElementTree as ET
 import datetime
 import openpyxl
+import queue
+import threading
+import re
+import types
+import tempfile
+import concurrent.futures
+import requests.adapters
+import hashlib
+import collections
+import multiprocessing
+import shutil
+import contextlib
+import io
+import itertools
+import time
+import locale
+import base64
 
 source_conn = None
+
+# rows per SELECT when paging through origin tables
+copy_chunk_size = 100000
+
+# rows buffered by the bulk writer before they are flushed in one transaction
+bulk_buffer_size = 10000
+
+# rows fetched per round trip by streaming origin cursors
+stream_itersize = 2000
+
+# directory for temporary asset downloads, None uses the system default
+download_dir = None
+
+# bytes read and written per step when streaming files into the filestore
+blob_chunk_size = 1024*1024
+
+# bytes passed to the xml parser at once
+xml_parse_chunk_size = 1024*1024
+
+# parallel xml_files_to_source splits the files into this many shards per
+# worker, so a worker with big files does not hold up the merge
+xml_shards_per_worker = 4
+
+# longest statement written by dump_mysql, mysql refuses packets above
+# max_allowed_packet
+mysql_packet_size = 1024*1024
+
+# rows sampled by csv_to_source to infer the column types
+csv_sample_rows = 10000
+
+# smallest byte range of a csv file parsed by one worker of csv_to_source
+csv_min_range_size = 16*1024*1024
+
+# set in the workers of xml_files_to_source: "xmldata.transcribed" gets the
+# node id of each row in "__node_id"
+xml_transcribed_node_ids = False
+
+# entries kept in the per-run caches of eas_to_source
+eas_cache_size = 10000
+
+# set by prepare_source: directory of the source, and the directory file data
+# is written to instead of filestore.data (None keeps it in the source)
+source_dir = None
+filestore_dir = None
+
+# page cache and memory map of the source during a bulk load
+bulk_load_cache_size = 256*1024*1024
+bulk_load_mmap_size = 1024*1024*1024
+
+# set by prepare_source(bulk_load=True): index statements deferred until
+# their table is copied, or until __commit_source
+bulk_load_session = None
+
+# indexes of the base tables, created by prepare_source
+source_indexes = [
+    ("xmldata", """CREATE INDEX IF NOT EXISTS xmldata_idx ON xmldata (
+               node_id_path
+        )"""),
+    ("file", """CREATE INDEX IF NOT EXISTS file_idx ON file (
+               source_name,
+               source_table_name,
+               source_column_name,
+               source_unique_id
+        )""")
+]
+
+# run report of the extract, started by prepare_source and written as json
+# by __commit_source. every table copy and eas batch gets a record.
+telemetry = None
+
+# seconds between two progress lines of a table copy
+progress_interval = 2.0
+
+onCreate_index_re = re.compile(r"\s*CREATE\s+(UNIQUE\s+)?INDEX\s", re.IGNORECASE)
+
 global args
 global silent
 
@@ -118,24 +211,289 @@ def __execute(cursor, sql, bindings=None):
 
         raise e
 
+# the bulk writer buffers rows for source_conn and flushes them with
+# executemany, each flush runs in its own transaction. rows for different
+# insert statements can be mixed, the buffer is flushed whenever the
+# statement changes, so the insert order is kept. a checkpoint returns a
+# statement and its bindings, executed in the transaction of the flush
+# that writes the rows up to the checkpoint.
+def __bulk_writer(buffer_size=None):
+    global source_conn
+
+    if buffer_size == None:
+        buffer_size = bulk_buffer_size
+
+    return {
+        "cursor": source_conn.cursor(),
+        "buffer_size": max(1, buffer_size),
+        "insert": None,
+        "rows": [],
+        "checkpoint": None,
+        "stats": None,
+        "page_size": source_conn.execute("""PRAGMA page_size""").fetchone()[0],
+        "count": 0
+        }
+
+# stats is the telemetry record the rows of insert are counted in
+def __bulk_write(writer, insert, row, checkpoint=None, stats=None):
+    if writer["insert"] != insert:
+        __bulk_flush(writer)
+        writer["insert"] = insert
+        writer["stats"] = stats
+
+    writer["rows"].append(row)
+    if checkpoint != None:
+        writer["checkpoint"] = checkpoint
+    if len(writer["rows"]) >= writer["buffer_size"]:
+        __bulk_flush(writer)
+
+def __bulk_flush(writer):
+    global source_conn
+
+    rows = writer["rows"]
+    if len(rows) == 0:
+        return
+
+    cursor = writer["cursor"]
+    stats = writer["stats"]
+    if stats != None:
+        start = time.perf_counter()
+        page_count = source_conn.execute("""PRAGMA page_count""").fetchone()[0]
+
+    if not source_conn.in_transaction:
+        cursor.execute("BEGIN")
+    cursor.execute("SAVEPOINT bulk_flush")
+    try:
+        cursor.executemany(writer["insert"], rows)
+    except Exception as e:
+        cursor.execute("ROLLBACK TO bulk_flush")
+        writer["rows"] = []
+        writer["checkpoint"] = None
+        try:
+            # replay row by row, so the offending row gets reported. the
+            # replayed rows are rolled back too, nothing of the batch is kept
+            for row in rows:
+                __execute(cursor, writer["insert"], row)
+        finally:
+            cursor.execute("ROLLBACK TO bulk_flush")
+            cursor.execute("RELEASE bulk_flush")
+        raise e
+    if writer["checkpoint"] != None:
+        cursor.execute(*writer["checkpoint"]())
+        writer["checkpoint"] = None
+    cursor.execute("RELEASE bulk_flush")
+    source_conn.commit()
+
+    if stats != None:
+        stats["insert_time"] += time.perf_counter() - start
+        stats["bytes_written"] += (source_conn.execute("""PRAGMA page_count""").fetchone()[0] - page_count) * writer["page_size"]
+
+    writer["count"] += len(rows)
+    writer["rows"] = []
+
+def __bulk_close(writer):
+    __bulk_flush(writer)
+    writer["cursor"].close()
+
 def __commit_source ():
     global source_conn
     if source_conn:
         source_conn.commit()
+        if bulk_load_session != None:
+            __finish_bulk_load()
         source_conn.close()
         print("Notice: Commited source.")
+        __write_telemetry_report()
+
+def __telemetry_start(filename, report):
+    global telemetry
+
+    telemetry = {
+        "source": filename,
+        "report": report,
+        "started": time.time(),
+        "records": []
+        }
+
+# returns a new record for the run report. times are seconds: fetch_time
+# waits for the origin, convert_time runs python conversions, insert_time
+# writes to the source. bytes_read is the size of the values read,
+# bytes_written the growth of the source.
+def __telemetry_record(kind, name):
+    record = {
+        "kind": kind,
+        "name": name,
+        "rows": 0,
+        "files": 0,
+        "bytes_read": 0,
+        "bytes_written": 0,
+        "fetch_time": 0.0,
+        "convert_time": 0.0,
+        "insert_time": 0.0,
+        "started": time.time(),
+        "elapsed": None,
+        "rows_per_second": None,
+        "progress_time": time.monotonic()
+        }
+    if telemetry != None:
+        telemetry["records"].append(record)
+    return record
+
+def __telemetry_finish(record, rows=None):
+    if rows != None:
+        record["rows"] = rows
+    record["elapsed"] = time.time() - record["started"]
+    if record["elapsed"] > 0:
+        record["rows_per_second"] = record["rows"] / record["elapsed"]
+
+def __write_telemetry_report():
+    if telemetry == None or telemetry["report"] == None:
+        return
+
+    records = []
+    for record in telemetry["records"]:
+        record = dict(record)
+        del record["progress_time"]
+        records.append(record)
+
+    report = {
+        "source": telemetry["source"],
+        "started": datetime.datetime.fromtimestamp(telemetry["started"]).isoformat(),
+        "elapsed": time.time() - telemetry["started"],
+        "tables": [record for record in records if record["kind"] == "table"],
+        "assets": [record for record in records if record["kind"] == "assets"]
+        }
+
+    with open(telemetry["report"], "w") as f:
+        json.dump(report, f, indent=2)
+    print("Notice: Report written to", telemetry["report"])
+
+# returns True at most every progress_interval seconds for a record
+def __progress_due(record):
+    now = time.monotonic()
+    if now - record["progress_time"] < progress_interval:
+        return False
+    record["progress_time"] = now
+    return True
+
+# approximate size of the values of a row in bytes
+def __row_size(values):
+    size = 0
+    for v in values:
+        if isinstance(v, (str, bytes)):
+            size += len(v)
+        elif v != None:
+            size += 8
+    return size
+
+# creates an index of the source now, or defers it to the end of the
+# copy of table_name in a bulk load session
+def __create_source_index(table_name, cmd):
+    global source_conn
+
+    if bulk_load_session != None:
+        bulk_load_session["indexes"].append((table_name, cmd))
+    else:
+        __execute(source_conn, cmd)
+
+# creates the deferred indexes of table_name, all of them for None
+def __create_deferred_indexes(table_name=None):
+    global source_conn
+
+    if bulk_load_session == None:
+        return
+
+    keep = []
+    for (tn, cmd) in bulk_load_session["indexes"]:
+        if table_name == None or tn == table_name:
+            __execute(source_conn, cmd)
+        else:
+            keep.append((tn, cmd))
+    bulk_load_session["indexes"] = keep
+    source_conn.commit()
+
+def __finish_bulk_load():
+    global source_conn, bulk_load_session
+
+    __create_deferred_indexes()
+    __execute(source_conn, """ANALYZE""")
+    source_conn.commit()
+    # back to the rollback journal, so the source is a single file again
+    source_conn.execute("""PRAGMA journal_mode=DELETE""")
+    source_conn.execute("""PRAGMA synchronous=FULL""")
+    bulk_load_session = None
+    print("Notice: Finished bulk load session.")
 
 def __pg_get_schema(conn,
                     schema_name=None,
                     include_tables=None,
                     include_tables_exclusive=True,
                     include_schema_in_table_name=True,
-                    exclude_tables=None):
+                    exclude_tables=None,
+                    schema_cache=None): # directory to keep the schema in, reused until the catalog changes
 
     cur = conn.cursor()
     cur.execute("SELECT current_database()")
     db_name = cur.fetchall()[0][0]
 
+    schema = None
+    if schema_cache != None:
+        cache_file = __pg_schema_cache_file(cur, schema_cache, db_name, schema_name, include_schema_in_table_name)
+        schema = __read_schema_cache(cache_file)
+
+    if schema == None:
+        schema = __pg_read_schema(cur, db_name, schema_name, include_schema_in_table_name)
+        if schema_cache != None:
+            __write_schema_cache(cache_file, schema)
+
+    __filter_schema(
+        schema=schema,
+        include_tables=include_tables,
+        include_tables_exclusive=include_tables_exclusive,
+        exclude_tables=exclude_tables
+        )
+
+    return schema
+
+# bump to ignore the schema caches written before
+schema_cache_version = 1
+
+# the cache file of a schema. the fingerprint of the catalog changes with
+# every table, column or index created, altered or dropped: rows written to
+# pg_class, pg_attribute and pg_index get a new xmin.
+def __pg_schema_cache_file(cur, schema_cache, db_name, schema_name, include_schema_in_table_name):
+    __execute(cur, """
+    SELECT
+      (SELECT count(*)||'-'||sum(xmin::text::bigint) FROM pg_catalog.pg_class),
+      (SELECT count(*)||'-'||sum(xmin::text::bigint) FROM pg_catalog.pg_attribute),
+      (SELECT count(*)||'-'||sum(xmin::text::bigint) FROM pg_catalog.pg_index),
+      inet_server_addr()::text,
+      inet_server_port(),
+      current_setting('server_version_num')""")
+    fingerprint = list(cur.fetchone())
+
+    key = json.dumps([schema_cache_version, "postgresql", db_name, schema_name, include_schema_in_table_name, fingerprint])
+    return os.path.join(schema_cache, "pg-%s.json" % hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+def __read_schema_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            schema = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    print("Notice: Using cached schema", cache_file)
+    return schema
+
+def __write_schema_cache(cache_file, schema):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with open(cache_file+".tmp", "w") as f:
+        json.dump(schema, f)
+    os.replace(cache_file+".tmp", cache_file)
+    print("Notice: Cached schema in", cache_file)
+
+# reads the columns and primary keys of all tables from the catalog
+def __pg_read_schema(cur, db_name, schema_name, include_schema_in_table_name):
     schema = {
         "tables": {},
         "type": "postgresql",
@@ -144,12 +502,16 @@ def __pg_get_schema(conn,
 
     if schema_name != None:
         schema_filter = " AND table_schema = '"+schema_name+"'"
+        pk_filter = "AND n.nspname = %s"
+        pk_bindings = [schema_name]
     else:
         schema_filter = ""
+        pk_filter = ""
+        pk_bindings = []
 
     cur.execute("""
     SELECT
-      table_schema, table_name, column_name, data_type
+      table_schema, table_name, column_name, data_type, udt_name
 
     FROM
       information_schema.columns
@@ -215,42 +577,37 @@ def __pg_get_schema(conn,
         if row[3] != "bytea":
             tb["columns"].append({
                     "name": column_name,
-                    "type": data_type
+                    "type": data_type,
+                    "udt_name": row[4]
                     })
 
+    # the primary keys of all tables at once, in the order of the key
+    tables = {}
     for (tn, tb) in list(schema["tables"].items()):
+        tb["primary_keys"] = []
+        tables[(tb["schema_name"], tb["table_name"])] = tb
 
-        select = """
+    __execute(cur, """
     SELECT
-      tc.table_name, c.column_name, c.data_type
+      n.nspname, c.relname, a.attname
     FROM
-      information_schema.table_constraints tc
+      pg_catalog.pg_index i
     JOIN
-      information_schema.constraint_column_usage AS ccu
-      USING (constraint_schema, constraint_name)
+      pg_catalog.pg_class c ON c.oid = i.indrelid
     JOIN
-      information_schema.columns AS c
-      ON
-        c.table_schema = tc.constraint_schema AND
-        tc.table_name = c.table_name AND
-        ccu.column_name = c.column_name
+      pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    JOIN
+      LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, key_position) ON true
+    JOIN
+      pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
     WHERE
-       constraint_type = 'PRIMARY KEY' AND
-       tc.table_name = '%s' AND
-       tc.table_schema = '%s' """ % (tb["table_name"], tb["schema_name"])
-
-        __execute(cur, select)
-
-        tb["primary_keys"] = []
-        for pk_row in cur.fetchall():
-            tb["primary_keys"].append(pk_row[1])
+      i.indisprimary %s
+    ORDER BY n.nspname, c.relname, k.key_position""" % pk_filter, pk_bindings)
 
-    __filter_schema(
-        schema=schema,
-        include_tables=include_tables,
-        include_tables_exclusive=include_tables_exclusive,
-        exclude_tables=exclude_tables
-        )
+    for pk_row in cur.fetchall():
+        tb = tables.get((pk_row[0], pk_row[1]))
+        if tb != None:
+            tb["primary_keys"].append(pk_row[2])
 
     return schema
 
@@ -360,6 +717,43 @@ def __create_schema_in_source (name, schema):
             )
     return
 
+# keeps the tables created for the schema by an earlier run, only
+# tables new to the schema are created
+def __resume_schema_in_source (name, schema):
+    print("""\nResuming tables for "%s" """ % schema["database"])
+
+    for (tn, tb) in list(schema["tables"].items()):
+        source_table_name = __origin_source_table(name, schema, tn)
+        if source_table_name == None:
+            __create_table_in_source(
+                origin_database_name = schema["database"],
+                origin_type = schema["type"],
+                source_name = name,
+                origin_table_name = tn,
+                table_def = tb
+                )
+        else:
+            tb["table_name_in_source"] = name.lower()+"."+source_table_name
+
+# returns the name of the table an origin table was copied to, None if
+# it is not in the source
+def __origin_source_table (name, schema, origin_table_name):
+    global source_conn
+
+    sql = source_conn.cursor()
+    __execute(sql, """
+     SELECT source_table_name FROM origin WHERE
+        origin_type = ? AND
+        origin_database_name = ? AND
+        origin_table_name = ? AND
+        source_name = ?""", [schema["type"], schema["database"], origin_table_name, name.lower()])
+    row = sql.fetchone()
+    sql.close()
+
+    if row == None:
+        return None
+    return row[0]
+
 def __create_table_in_source (
     origin_database_name,
     origin_type,
@@ -447,13 +841,54 @@ SELECT origin_id, source_table_name FROM origin WHERE
         cmd = table_def["onCreate"].replace("%TABLE_NAME_IN_SOURCE%", table_def["table_name_in_source"])
 
         print("""Notice: %s[onCreate]: %s""" % (table_def["table_name_in_source"], cmd))
-        __execute(sql, cmd)
-
+        if onCreate_index_re.match(cmd):
+            __create_source_index(table_def["table_name_in_source"], cmd)
+        else:
+            __execute(sql, cmd)
+
+
+def __paramstyle_placeholder(schema):
+    # psycopg2 and MySQLdb use "format", sqlite3 uses "qmark"
+    if schema.get("type") in ("postgresql", "mysql"):
+        return "%s"
+    return "?"
+
+def __keyset_columns(schema, tb):
+    # keyset pagination needs the full primary key in the select list
+    # and the primary key order, a custom "orderby" would break the seek
+    pks = tb["primary_keys"]
+    if len(pks) == 0 or "orderby" in tb:
+        return None
+
+    idx_by_name = {}
+    for idx, column in enumerate(tb["columns"]):
+        idx_by_name[column["name"]] = idx
+
+    pk_idxs = []
+    for pk in pks:
+        if pk not in idx_by_name:
+            return None
+        if schema.get("type", "sqlite") == "sqlite":
+            # with text_factory = bytes, text keys come back as blobs
+            # which sqlite never compares equal to text, so only integer
+            # keys are safe to seek on
+            if "INT" not in tb["columns"][idx_by_name[pk]]["type"].upper():
+                return None
+        pk_idxs.append(idx_by_name[pk])
+
+    return pk_idxs
 
 def __copy_data_to_source (
     conn,
     schema,
-    limit = None
+    limit = None,
+    pagination = "keyset", # "keyset" or "offset", keyset falls back to offset for tables without primary key
+    parallel = None, # number of tables copied at once, needs connect
+    connect = None, # returns a new origin connection for a parallel worker
+    reader = "cursor", # "cursor" or "copy", copy streams postgres COPY output
+    streaming = False, # read through server side cursors, postgresql and mysql only
+    itersize = None, # rows fetched per round trip by a streaming cursor
+    resume = False # skip tables finished by an earlier run, continue partial ones after their checkpoint
     ):
 
     global source_conn, args
@@ -461,121 +896,589 @@ def __copy_data_to_source (
     if "database" in schema:
         print("""\nCopying data for "%s" """ % schema["database"])
 
-    chunk = 100000
+    if pagination not in ("keyset", "offset"):
+        print("""Error: pagination needs to be "keyset" or "offset".""")
+        sys.exit(1)
+
+    if reader not in ("cursor", "copy") or (reader == "copy" and schema.get("type") != "postgresql"):
+        print("""Error: reader needs to be "cursor", or "copy" for postgresql.""")
+        sys.exit(1)
+
+    copies = []
+    for (table_name, tb) in list(schema["tables"].items()):
+        copy = __table_copy(schema, tb, limit, pagination, reader)
+        if copy != None:
+            if streaming and schema.get("type") in ("postgresql", "mysql"):
+                copy["streaming"] = schema["type"]
+                copy["itersize"] = itersize or stream_itersize
+            if __start_copy_checkpoint(copy, resume):
+                copy["stats"] = __telemetry_record("table", copy["table_name_in_source"])
+                copy["stats"]["pagination"] = copy["pagination"]
+                copies.append(copy)
+    source_conn.commit()
+
+    if parallel != None and parallel > 1 and connect != None:
+        __copy_tables_parallel(copies, parallel, connect)
+        return
+
+    writer = __bulk_writer()
+
+    for copy in copies:
+        prefix = "Notice: "+copy["table_name_in_source"]
+        if not silent:
+            print(prefix, end=' ')
+
+        sys.stdout.flush()
+
+        def checkpoint():
+            return __copy_checkpoint(copy)
+
+        stats = copy["stats"]
+        def emit(save_row):
+            __bulk_write(writer, copy["insert"], save_row, checkpoint, stats)
+
+            if not silent and __progress_due(stats):
+                print("\r"+prefix, copy["count"], "rows...", end=' ')
+                sys.stdout.flush()
+
+        copy["read"](conn, copy, emit)
+        __bulk_flush(writer)
+        __finish_copy_checkpoint(copy)
+        __create_deferred_indexes(copy["table_name_in_source"])
+        __telemetry_finish(stats, copy["count"])
+
+        print("\r"+prefix, copy["count"], "rows.", "Pagination:", copy["pagination"], "(%d rows/s)" % (stats["rows_per_second"] or 0))
+        sys.stdout.flush()
+
+    __bulk_close(writer)
+    return
+
+# every flush of a table copy records the rows copied so far and the key of
+# the last row in copy_checkpoint, in the same transaction. a resumed copy
+# skips finished tables and continues keyset copies after the last key,
+# other partial copies start over.
+def __start_copy_checkpoint(copy, resume):
+    global source_conn
+
+    source_conn.execute("""CREATE TABLE IF NOT EXISTS copy_checkpoint (
+       table_name_in_source TEXT PRIMARY KEY,
+       last_key TEXT,
+       row_count INTEGER NOT NULL,
+       done INTEGER NOT NULL,
+       checkpoint_time DATETIME DEFAULT CURRENT_TIMESTAMP
+    )""")
 
     sql = source_conn.cursor()
-    cur = conn.cursor()
-    tables = schema["tables"]
+    tn = copy["table_name_in_source"]
 
+    row = None
+    if resume:
+        __execute(sql, """SELECT last_key, row_count, done FROM copy_checkpoint WHERE table_name_in_source=?""", [tn])
+        row = sql.fetchone()
 
-    for (table_name, tb) in list(tables.items()):
-        qms = []
-        column_names = []
+    if row != None and row[2]:
+        print("Notice:", tn, row[1], "rows, finished before. Skipping.")
+        sql.close()
+        return False
 
-        where = ""
-        use_limit = limit
+    if row != None and row[0] != None and copy["pagination"] == "keyset":
+        copy["resume_key"] = json.loads(row[0])
+        copy["count"] = row[1]
+        print("Notice:", tn, "resuming after", row[1], "rows.")
+    else:
+        # upserted rows are replaced anyway
+        if copy["replace"] or (row != None and not copy["upsert"]):
+            __execute(sql, """DELETE FROM "%s" """ % tn)
+        __execute(sql, """DELETE FROM copy_checkpoint WHERE table_name_in_source=?""", [tn])
 
-        if "where" in tb:
-            w = tb["where"]
-            if w != None and len(w) > 0:
-                where = "WHERE "+w
+    sql.close()
+    return True
 
-        if "limit" in tb:
-            use_limit = tb["limit"]
+# returns the checkpoint statement for the rows read so far
+def __copy_checkpoint(copy, done=False):
+    last_key = None
+    if copy["pk_idxs"] != None and copy.get("last_row") != None:
+        last_key = json.dumps([copy["last_row"][idx] for idx in copy["pk_idxs"]], default=str)
 
-        if "orderby" in tb:
-            use_orderby = "ORDER BY "+tb["orderby"]
-        elif len(tb["primary_keys"]) > 0:
-            use_orderby = "ORDER BY \""+"\",\"".join(tb["primary_keys"])+"\""
-        else:
-            use_orderby = ""
+    return ("""INSERT OR REPLACE INTO copy_checkpoint
+          (table_name_in_source, last_key, row_count, done)
+          VALUES (?,?,?,?)""", [copy["table_name_in_source"], last_key, copy["count"], done])
 
-        if use_limit == 0:
-            print("""Notice: Not copying data for table "%s", request limit is 0. Use None for no limit.""")
-            continue
+def __finish_copy_checkpoint(copy):
+    global source_conn
 
-        copy_source_unique_id = False
-        for idx, column in enumerate(tb["columns"]):
-            column_names.append('"'+column["name"]+'"')
-            if column["name"] == "__source_unique_id":
-                copy_source_unique_id = True
+    source_conn.execute(*__copy_checkpoint(copy, done=True))
+    source_conn.commit()
+
+# builds the statements to copy one origin table, returns None if
+# the table is not to be copied
+def __table_copy(schema, tb, limit, pagination, reader="cursor"):
+    qms = []
+    column_names = []
 
-            qms.append("?")
+    where = ""
+    use_limit = limit
 
-        columns = ",".join(column_names)
-        if copy_source_unique_id:
-            insert = """INSERT INTO "%s" (%s) VALUES (%s)""" % (tb["table_name_in_source"], columns, ",".join(qms))
-        else:
-            insert = """INSERT INTO "%s" (__source_unique_id, %s) VALUES (?, %s)""" % (tb["table_name_in_source"], columns, ",".join(qms))
+    if "where" in tb:
+        w = tb["where"]
+        if w != None and len(w) > 0:
+            where = "WHERE "+w
 
-        prefix = "Notice: "+tb["table_name_in_source"]
-        if not silent:
-            print(prefix, end=' ')
+    if "limit" in tb:
+        use_limit = tb["limit"]
 
-        sys.stdout.flush()
+    if "orderby" in tb:
+        use_orderby = "ORDER BY "+tb["orderby"]
+    elif len(tb["primary_keys"]) > 0:
+        use_orderby = "ORDER BY \""+"\",\"".join(tb["primary_keys"])+"\""
+    else:
+        use_orderby = ""
 
-        count = 0
-        offset = 0
-        while True:
-            chunk_count = 0
+    if use_limit == 0:
+        print("""Notice: Not copying data for table "%s", request limit is 0. Use None for no limit.""")
+        return None
 
-            # limit chunk to the maximium wanted table "limit"
-            if use_limit is not None and use_limit > 0 and offset + chunk > use_limit:
-                use_chunk = use_limit - offset
-                if use_chunk == 0:
-                    break
-            else:
-                use_chunk = chunk
+    copy_source_unique_id = False
+    for idx, column in enumerate(tb["columns"]):
+        column_names.append('"'+column["name"]+'"')
+        if column["name"] == "__source_unique_id":
+            copy_source_unique_id = True
+
+        qms.append("?")
+
+    columns = ",".join(column_names)
+
+    # incremental copies replace the rows with the same __source_unique_id
+    if tb.get("upsert"):
+        insert_verb = "INSERT OR REPLACE"
+    else:
+        insert_verb = "INSERT"
+
+    # positions of the primary key columns in the select, for __source_unique_id
+    column_idxs = {}
+    for idx, column in enumerate(tb["columns"]):
+        column_idxs[column["name"]] = idx
 
+    if copy_source_unique_id:
+        unique_id_idxs = None
+        insert = """%s INTO "%s" (%s) VALUES (%s)""" % (insert_verb, tb["table_name_in_source"], columns, ",".join(qms))
+    else:
+        unique_id_idxs = [column_idxs[pk_name] for pk_name in tb["primary_keys"]]
+        insert = """%s INTO "%s" (__source_unique_id, %s) VALUES (?, %s)""" % (insert_verb, tb["table_name_in_source"], columns, ",".join(qms))
+
+    copy = {
+        "table_name_in_source": tb["table_name_in_source"],
+        "select": [columns, tb["table_name_select_escaped"], where, use_orderby],
+        "insert": insert,
+        "limit": use_limit,
+        "unique_id_idxs": unique_id_idxs,
+        "pk_idxs": None,
+        "upsert": tb.get("upsert", False),
+        "replace": tb.get("replace", False),
+        "read": __read_table,
+        "streaming": None,
+        "count": 0
+        }
+
+    if reader == "copy":
+        # one COPY streams the whole table, no paging needed
+        copy["read"] = __read_table_pg_copy
+        copy["converters"] = [__pg_copy_converter(column["type"], column.get("udt_name")) for column in tb["columns"]]
+        copy["pagination"] = "copy"
+        tb["pagination"] = copy["pagination"]
+        return copy
+
+    if pagination == "keyset" and copy_chunk_size > 0:
+        copy["pk_idxs"] = __keyset_columns(schema, tb)
+
+    if copy["pk_idxs"] != None:
+        qm = __paramstyle_placeholder(schema)
+        seek_parts = list(copy["select"])
+        if qm == "%s":
+            # bindings are passed, so a literal "%" needs escaping
+            seek_parts = [part.replace("%", "%%") for part in seek_parts]
+
+        pk_columns = ",".join(['"'+pk+'"' for pk in tb["primary_keys"]])
+        seek = "(%s) > (%s)" % (pk_columns, ",".join([qm]*len(copy["pk_idxs"])))
+        if where != "":
+            seek_parts[2] = "WHERE ("+seek_parts[2][6:]+") AND "+seek
+        else:
+            seek_parts[2] = "WHERE "+seek
+        copy["seek_select"] = seek_parts
+        copy["pagination"] = "keyset"
+    else:
+        copy["pagination"] = "offset"
+
+    tb["pagination"] = copy["pagination"]
+    return copy
+
+# server side cursors need a name unique for the connection
+origin_cursor_count = 0
+
+# returns a cursor for one select of a table copy. streaming cursors keep the
+# result on the server and fetch "itersize" rows at a time, so memory
+# depends on itersize and not on copy_chunk_size.
+def __origin_cursor(conn, copy):
+    global origin_cursor_count
+
+    if copy["streaming"] == "postgresql":
+        origin_cursor_count += 1
+        cur = conn.cursor(name="extract_%s" % origin_cursor_count)
+        cur.itersize = copy["itersize"]
+        return cur
+
+    if copy["streaming"] == "mysql":
+        return conn.cursor(MySQLdb.cursors.SSCursor)
+
+    return conn.cursor()
+
+# runs the selects for a table copy on the origin connection and passes
+# every converted row to emit
+def __read_table(conn, copy, emit):
+    chunk = copy_chunk_size
+    use_limit = copy["limit"]
+    unique_id_idxs = copy["unique_id_idxs"]
+    pk_idxs = copy["pk_idxs"]
+    stats = copy["stats"]
+
+    offset = 0
+    last_key = copy.get("resume_key")
+    while True:
+        chunk_count = 0
+
+        # limit chunk to the maximium wanted table "limit"
+        if use_limit is not None and use_limit > 0 and copy["count"] + chunk > use_limit:
+            use_chunk = use_limit - copy["count"]
+            if use_chunk == 0:
+                break
+        else:
+            use_chunk = chunk
+
+        bindings = None
+        if pk_idxs != None:
+            lm = "LIMIT "+str(use_chunk)
+            if last_key != None:
+                select = """SELECT %s FROM %s %s %s %s""" % tuple(copy["seek_select"] + [lm])
+                bindings = last_key
+            else:
+                select = """SELECT %s FROM %s %s %s %s""" % tuple(copy["select"] + [lm])
+        else:
             if use_chunk > 0:
                 lm = "LIMIT "+str(use_chunk)+" OFFSET "+str(offset)
             else:
                 lm = ""
 
-            select = """SELECT %s FROM %s %s %s %s""" % (columns, tb["table_name_select_escaped"], where, use_orderby, lm)
-            __execute(cur, select)
+            select = """SELECT %s FROM %s %s %s %s""" % tuple(copy["select"] + [lm])
 
-            for row in cur:
-                rec = {}
-                for idx, column in enumerate(tb["columns"]):
-                    cn = column["name"]
-                    if isinstance(row[idx], bytes):
-                        rec[cn] = __str_to_unicode(row[idx])
-                    else:
-                        rec[cn] = row[idx]
+        cur = __origin_cursor(conn, copy)
+        fetched = time.perf_counter()
+        __execute(cur, select, bindings)
 
-                save_row = []
-                if not copy_source_unique_id:
-                    pk_data = []
-                    for idx, pk_name in enumerate(tb["primary_keys"]):
-                        pk_data.append(__value_to_unicode(rec[pk_name]))
+        row = None
+        for row in cur:
+            converted = time.perf_counter()
+            stats["fetch_time"] += converted - fetched
 
-                    source_unique_id = "-".join(pk_data)
-                    if len(source_unique_id) == 0:
-                        source_unique_id = None
-                    save_row.append(source_unique_id)
+            values = [__str_to_unicode(v) if isinstance(v, bytes) else v for v in row]
+            stats["bytes_read"] += __row_size(values)
 
-                for idx, column in enumerate(tb["columns"]):
-                    save_row.append(rec[column["name"]])
+            if unique_id_idxs == None:
+                save_row = values
+            else:
+                source_unique_id = "-".join([__value_to_unicode(values[idx]) for idx in unique_id_idxs])
+                if len(source_unique_id) == 0:
+                    source_unique_id = None
+                save_row = [source_unique_id] + values
 
-                count += 1
-                chunk_count += 1
-                # print save_row
+            copy["count"] += 1
+            copy["last_row"] = row
+            chunk_count += 1
+            # print save_row
 
-                __execute(sql, insert, save_row)
+            fetched = time.perf_counter()
+            stats["convert_time"] += fetched - converted
+            emit(save_row)
+            fetched = time.perf_counter()
 
-                if count%100==0 and not silent:
-                    print("\r"+prefix, count, "rows...", end=' ')
-                    sys.stdout.flush()
+        cur.close()
 
-            if chunk == 0 or chunk_count < chunk:
-                break
+        if chunk == 0 or chunk_count < use_chunk:
+            break
+
+        if pk_idxs != None:
+            # continue after the last row seen, using the raw origin values
+            last_key = [row[idx] for idx in pk_idxs]
+        else:
             offset += chunk
 
-        print("\r"+prefix, count, "rows.")
-        sys.stdout.flush()
+    return copy["count"]
+
+# element types of postgres arrays (udt_name without the leading "_"),
+# everything not listed here is kept as text
+pg_array_element_types = {
+    "int2": "INTEGER",
+    "int4": "INTEGER",
+    "int8": "INTEGER",
+    "float4": "REAL",
+    "float8": "REAL",
+    "bool": "NUMERIC"
+    }
+
+pg_copy_escapes = {
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+    "v": "\v"
+    }
+
+pg_copy_escape_re = re.compile(r"\\(.)")
+
+def __pg_copy_bool(s):
+    return s == "t"
+
+def __pg_copy_timestamp(s):
+    # psycopg2 returns a datetime, which sqlite stores with 6 fractional digits
+    if "." in s:
+        (seconds, fraction) = s.split(".", 1)
+        return seconds+"."+fraction.ljust(6, "0")
+    return s
+
+# returns a function converting a COPY text value to the python value
+# psycopg2 would return for the sqlite type of the column, None for text
+def __pg_copy_converter(sqlite_type, udt_name=None):
+    if sqlite_type == "INTEGER":
+        return int
+    if sqlite_type == "REAL":
+        return float
+    if sqlite_type == "decimal":
+        return decimal.Decimal
+    if sqlite_type == "NUMERIC":
+        # only boolean maps to NUMERIC
+        return __pg_copy_bool
+    if sqlite_type == "list":
+        element_type = None
+        if udt_name != None and udt_name.startswith("_"):
+            element_type = pg_array_element_types.get(udt_name[1:])
+        element = __pg_copy_converter(element_type)
+        return lambda s: __pg_parse_array(s, element)
+    if udt_name == "timestamp":
+        return __pg_copy_timestamp
+    return None
+
+def __pg_copy_unescape(s):
+    return pg_copy_escape_re.sub(lambda m: pg_copy_escapes.get(m.group(1), m.group(1)), s)
+
+# parses a postgres array literal like {1,2,NULL} or {{"a b",c},{d,e}}
+def __pg_parse_array(s, element=None):
+    if s.startswith("["):
+        # explicit dimensions: [0:1]={1,2}
+        s = s[s.index("=")+1:]
+
+    def parse(pos):
+        # s[pos] is "{"
+        items = []
+        pos += 1
+        while s[pos] != "}":
+            if s[pos] == "{":
+                (item, pos) = parse(pos)
+                items.append(item)
+            elif s[pos] == '"':
+                pos += 1
+                chars = []
+                while s[pos] != '"':
+                    if s[pos] == "\\":
+                        pos += 1
+                    chars.append(s[pos])
+                    pos += 1
+                pos += 1
+                item = "".join(chars)
+                items.append(element(item) if element != None else item)
+            else:
+                end = pos
+                while s[end] not in ",}":
+                    end += 1
+                item = s[pos:end]
+                pos = end
+                if item == "NULL":
+                    items.append(None)
+                else:
+                    items.append(element(item) if element != None else item)
+            if s[pos] == ",":
+                pos += 1
+        return (items, pos+1)
+
+    return parse(0)[0]
+
+# streams the table with COPY (SELECT ...) TO STDOUT in text format and
+# converts the rows like __read_table. the COPY runs as one statement, rows
+# are passed to emit while the data arrives.
+def __read_table_pg_copy(conn, copy, emit):
+    converters = copy["converters"]
+    unique_id_idxs = copy["unique_id_idxs"]
+
+    if copy["limit"] != None and copy["limit"] > 0:
+        lm = "LIMIT "+str(copy["limit"])
+    else:
+        lm = ""
 
-    return
+    select = """SELECT %s FROM %s %s %s %s""" % tuple(copy["select"] + [lm])
+
+    def emit_line(line):
+        try:
+            line = line.decode("utf-8")
+        except UnicodeDecodeError:
+            line = __str_to_unicode(line)
+
+        values = line.split("\t")
+        for idx, v in enumerate(values):
+            if v == "\\N":
+                values[idx] = None
+                continue
+            if "\\" in v:
+                v = __pg_copy_unescape(v)
+            if converters[idx] != None:
+                v = converters[idx](v)
+            values[idx] = v
+
+        if unique_id_idxs == None:
+            save_row = values
+        else:
+            source_unique_id = "-".join([__value_to_unicode(values[idx]) for idx in unique_id_idxs])
+            if len(source_unique_id) == 0:
+                source_unique_id = None
+            save_row = [source_unique_id] + values
+
+        copy["count"] += 1
+        emit(save_row)
+
+    # rows can be split across writes, keep the incomplete tail. the time
+    # outside of write is spent waiting for the origin.
+    stats = copy["stats"]
+    pending = [b"", time.perf_counter()]
+    def write(data):
+        start = time.perf_counter()
+        stats["fetch_time"] += start - pending[1]
+        insert_time = stats["insert_time"]
+
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        stats["bytes_read"] += len(data)
+        lines = (pending[0] + data).split(b"\n")
+        pending[0] = lines.pop()
+        for line in lines:
+            emit_line(line)
+
+        pending[1] = time.perf_counter()
+        stats["convert_time"] += pending[1] - start - (stats["insert_time"] - insert_time)
+
+    cmd = "COPY (%s) TO STDOUT" % select
+    print(cmd)
+    cur = conn.cursor()
+    cur.copy_expert(cmd, types.SimpleNamespace(write=write))
+    cur.close()
+
+    if len(pending[0]) > 0:
+        emit_line(pending[0])
+
+    return copy["count"]
+
+# copies the tables on a pool of worker threads, each with its own origin
+# connection. rows are passed through a bounded queue to this thread, which
+# is the only one writing to source_conn.
+def __copy_tables_parallel(copies, parallel, connect):
+    global source_conn
+
+    tasks = queue.Queue()
+    for copy in copies:
+        tasks.put(copy)
+
+    results = queue.Queue(maxsize=parallel*4)
+    stop = threading.Event()
+
+    def work():
+        conn = None
+        try:
+            conn = connect()
+            while not stop.is_set():
+                try:
+                    copy = tasks.get_nowait()
+                except queue.Empty:
+                    break
+
+                # the checkpoint is taken with the batch, the reader moves on
+                batch = []
+                def emit(save_row):
+                    batch.append(save_row)
+                    if len(batch) >= bulk_buffer_size:
+                        results.put(("rows", copy, (list(batch), __copy_checkpoint(copy))))
+                        del batch[:]
+                        if stop.is_set():
+                            raise Exception("parallel copy stopped")
+
+                copy["read"](conn, copy, emit)
+                results.put(("rows", copy, (batch, __copy_checkpoint(copy))))
+                results.put(("done", copy, __copy_checkpoint(copy, done=True)))
+        except Exception as e:
+            results.put(("error", None, e))
+        finally:
+            if conn != None:
+                conn.close()
+            results.put(("exit", None, None))
+
+    workers = []
+    for i in range(min(parallel, len(copies))):
+        t = threading.Thread(target=work, name="copy-%d" % i)
+        t.daemon = True
+        t.start()
+        workers.append(t)
+
+    print("Notice: Copying %s tables with %s workers." % (len(copies), len(workers)))
+    sys.stdout.flush()
+
+    writer = __bulk_writer()
+    written = {}
+    running = len(workers)
+    error = None
+    while running > 0:
+        (kind, copy, data) = results.get()
+        if kind == "exit":
+            running -= 1
+        elif kind == "error":
+            if error == None:
+                error = data
+            stop.set()
+        elif error != None:
+            # drain the queue, so blocked workers can exit
+            continue
+        elif kind == "rows":
+            (rows, statement) = data
+            checkpoint = lambda: statement
+            for save_row in rows:
+                __bulk_write(writer, copy["insert"], save_row, checkpoint, copy["stats"])
+            __bulk_flush(writer)
+
+            tn = copy["table_name_in_source"]
+            written[tn] = written.get(tn, 0) + len(rows)
+            if not silent and len(rows) > 0 and __progress_due(copy["stats"]):
+                print("Notice:", tn, written[tn], "rows...")
+                sys.stdout.flush()
+        elif kind == "done":
+            source_conn.execute(*data)
+            source_conn.commit()
+            __create_deferred_indexes(copy["table_name_in_source"])
+            __telemetry_finish(copy["stats"], copy["count"])
+            print("Notice:", copy["table_name_in_source"], copy["count"], "rows.", "Pagination:", copy["pagination"], "(%d rows/s)" % (copy["stats"]["rows_per_second"] or 0))
+            sys.stdout.flush()
+
+    for t in workers:
+        t.join()
+
+    __bulk_close(writer)
+
+    if error != None:
+        raise error
 
 def __value_to_unicode (v):
     if isinstance(v, str):
@@ -656,9 +1559,152 @@ def __store_eas_id (
     table_name, # table name in source
     source_unique_id,  # id in source
     column_name,  # column in source
-    eas_versions = { "original": ["url"] }
+    eas_versions = { "original": ["url"] },
+    cache = None, # cache from __eas_cache, shared by the calls of one run
+    stats = None # telemetry record of the batch
+    ):
+
+    if cache == None:
+        cache = __eas_cache()
+
+    start = time.perf_counter()
+    (jobs, ok) = __plan_eas_id(
+        http = requests,
+        name = name,
+        url = url,
+        instance = instance,
+        eas_id = eas_id,
+        table_name = table_name,
+        source_unique_id = source_unique_id,
+        column_name = column_name,
+        eas_versions = eas_versions,
+        cache = cache
+        )
+
+    planned = time.perf_counter()
+    for job in jobs:
+        __store_eas_file(cache, job, stats=stats)
+
+    if stats != None:
+        # files are downloaded while they are stored
+        stats["fetch_time"] += planned - start
+        stats["insert_time"] += time.perf_counter() - planned
+
+    return ok
+
+# the cache keeps the versions of eas ids, so root assets shared by many
+# assets are fetched once, and the eas files already stored. both are
+# bounded lru maps.
+def __eas_cache(size=None):
+    if size == None:
+        size = eas_cache_size
+
+    return {
+        "size": size,
+        "versions": collections.OrderedDict(), # eas id -> bulkversions entry
+        "files": collections.OrderedDict() # (eas id, version) -> True
+    }
+
+def __lru_get(cache, name, key):
+    entries = cache[name]
+    if key not in entries:
+        return None
+    entries.move_to_end(key)
+    return entries[key]
+
+def __lru_put(cache, name, key, value):
+    entries = cache[name]
+    entries[key] = value
+    entries.move_to_end(key)
+    while len(entries) > cache["size"]:
+        entries.popitem(last=False)
+
+# returns the bulkversions entries of the eas ids, only the ids not in the
+# cache are requested. returns None and the response on errors.
+def __fetch_eas_versions(http, url, instance, eas_ids, cache):
+    res = {}
+    missing = []
+    for eas_id in eas_ids:
+        versions = __lru_get(cache, "versions", eas_id)
+        if versions == None:
+            missing.append(eas_id)
+        else:
+            res[eas_id] = versions
+
+    if len(missing) > 0:
+        _res = http.get(url+"/bulkversions?instance="+instance+"&asset_ids=["+",".join(missing)+"]")
+        if _res.status_code != 200:
+            return (None, _res)
+
+        for (eas_id, versions) in list(res_get_json(_res).items()):
+            __lru_put(cache, "versions", eas_id, versions)
+            res[eas_id] = versions
+
+    return (res, None)
+
+# requests the root assets of the entries which are not cached yet, all
+# roots of one level with one request
+def __prefetch_eas_roots(http, url, instance, res, cache):
+    while True:
+        root_ids = set()
+        for versions in list(res.values()):
+            if versions.get("root_id") and str(versions["root_id"]) not in cache["versions"]:
+                root_ids.add(str(versions["root_id"]))
+
+        if len(root_ids) == 0:
+            return
+
+        (res, _res) = __fetch_eas_versions(http, url, instance, sorted(root_ids), cache)
+        if res == None:
+            print("""Warning: Root EAS-IDs %s not found or error from EAS-Server. Status: "%s".""" % (sorted(root_ids), _res.status_code), _res.text)
+            return
+
+# stores the file of a job from __plan_eas_id, unless the version of the eas
+# id is already stored (roots are shared by many assets, but the file table
+# holds every version of an eas id once). returns whether it was stored.
+def __store_eas_file(cache, job, download=None, stats=None):
+    key = (job["eas_id"], job["file_version"])
+
+    stored = __lru_get(cache, "files", key)
+    if stored == None:
+        sql = source_conn.cursor()
+        __execute(sql, """SELECT file_id FROM file WHERE eas_id=? AND file_version=?""", [job["eas_id"], job["file_version"]])
+        stored = sql.fetchone() != None
+        sql.close()
+
+    if stored:
+        print("Notice: EAS-ID", job["eas_id"], "["+job["file_version"]+"]", "already stored, skipping.")
+        if download != None:
+            os.remove(download[0])
+    else:
+        filesize = __store_file_from_url(download=download, **job)
+        if stats != None:
+            stats["files"] += 1
+            stats["bytes_read"] += filesize or 0
+
+    __lru_put(cache, "files", key, True)
+    return not stored
+
+# fetches the versions of the eas ids and returns the list of files to store,
+# in the order they need to be stored (root assets before their children),
+# and whether all versions could be exported. http is the requests module or a
+# requests.Session.
+def __plan_eas_id (
+    http,
+    name, # name of source
+    url,  # url of eas
+    instance, # instance of eas
+    eas_id,  # id for asset
+    table_name, # table name in source
+    source_unique_id,  # id in source
+    column_name,  # column in source
+    eas_versions = { "original": ["url"] },
+    cache = None # cache from __eas_cache
     ):
 
+    if cache == None:
+        cache = __eas_cache()
+
     if isinstance(eas_id, list):
         _eas_ids_a = list(map(str, eas_id))
         assert(isinstance(source_unique_id, list))
@@ -669,14 +1715,16 @@ def __store_eas_id (
 
     req = url+"/bulkversions?instance="+instance+"&asset_ids=["+",".join(_eas_ids_a)+"]"
 
-    _res = requests.get(req)
+    (res, _res) = __fetch_eas_versions(http, url, instance, _eas_ids_a, cache)
 
-    if _res.status_code != 200:
+    if res == None:
         print("""Warning: EAS-ID %s not found or error from EAS-Server. Status: "%s".""" % (_eas_ids_a, _res.status_code), _res.text)
-        return False
+        return ([], False)
 
-    res = res_get_json(_res)
+    # the roots are planned below, one by one from the cache
+    __prefetch_eas_roots(http, url, instance, res, cache)
 
+    jobs = []
     count = 0
     skips = 0
 
@@ -695,7 +1743,7 @@ def __store_eas_id (
 
             if not original:
                 print("Warning: EAS-ID", _eas_id, "Original not found.""")
-                return False
+                return (jobs, False)
 
             use_version = None
             for version in res[_eas_id]["versions"]:
@@ -720,7 +1768,8 @@ def __store_eas_id (
             if eas_root_id:
                 # we need to insert this first, because of a foreign key we
                 # have
-                ret = __store_eas_id(
+                (root_jobs, ret) = __plan_eas_id(
+                    http = http,
                     name = name,
                     instance = instance,
                     url = url,
@@ -728,141 +1777,384 @@ def __store_eas_id (
                     eas_versions = { eas_version: store_as },
                     table_name = table_name,
                     source_unique_id = _source_unique_id,
-                    column_name = column_name
+                    column_name = column_name,
+                    cache = cache
                     )
+                jobs.extend(root_jobs)
                 if ret == False:
                     print("Warning: Could not insert root id, not storing root_id", eas_root_id)
                     eas_root_id = None
 
-            __store_file_from_url(
-                url = url+use_version["link"],
-                name = name,
-                source_table_name = table_name,
-                source_unique_id = _source_unique_id,
-                source_column_name = column_name,
-                original_filename = original["custom"]["original_filename"],
-                file_unique_id = use_version["hash"],
-                eas_id = int(_eas_id),
-                eas_root_id = eas_root_id,
-                file_version = eas_version,
-                store_as = store_as
-                )
+            jobs.append({
+                "url": url+use_version["link"],
+                "name": name,
+                "source_table_name": table_name,
+                "source_unique_id": _source_unique_id,
+                "source_column_name": column_name,
+                "original_filename": original["custom"]["original_filename"],
+                "file_unique_id": use_version["hash"],
+                "eas_id": int(_eas_id),
+                "eas_root_id": eas_root_id,
+                "file_version": eas_version,
+                "store_as": store_as
+                })
 
     if skips > 0:
         print("Warning: %s out of %s versions failed to export." % (skips, count))
-        return False
+        return (jobs, False)
     else:
-        return True
+        return (jobs, True)
 
-# stores file as blob from url
-def __store_file_from_url (
-    name,              # name of source
-    url,               # url to fetch data from
-    source_table_name, # table this is meant for
-    source_unique_id,  # row in table this is meant for
-    source_column_name,# column in table this is meant for
-    file_unique_id,    # a unique id provided to store the file
-    eas_id = None,     # optional eas-id
-    eas_root_id = None,# optional eas-root-id
-    file_version = None,# optional version
-    original_filename = None, # original_filename of file
-    store_as = ["data"] # allowed values are "data", "url", "file"
-    ):
+# downloads url into a temporary file, returns filename and mimetype
+def __download_to_tempfile(http, url):
+    req = http.get(url, stream=True)
+    try:
+        filename = __response_to_tempfile(req)
+    finally:
+        req.close()
+    return (filename, req.headers.get("content-type"))
+
+# writes the body of a streamed response into a temporary file, returns the filename
+def __response_to_tempfile(req):
+    fd, filename = tempfile.mkstemp(prefix="eas-", dir=download_dir)
+    try:
+        with os.fdopen(fd, "wb") as fl:
+            for data in req.iter_content(blob_chunk_size):
+                fl.write(data)
+    except Exception as e:
+        os.remove(filename)
+        raise e
+    return filename
+
+# returns the size of the body of a streamed response, or None if it is
+# only known after reading it (no Content-Length, or the body is decoded
+# on the fly)
+def __response_size(req):
+    if req.headers.get("content-encoding", "identity").lower() != "identity":
+        return None
+    try:
+        return int(req.headers["content-length"])
+    except (KeyError, ValueError):
+        return None
 
-    global silent
+# yields the content of a file in chunks
+def __file_chunks(fn):
+    with open(fn, 'rb') as fl:
+        while True:
+            data = fl.read(blob_chunk_size)
+            if not data:
+                break
+            yield data
+
+# writes chunks into the preallocated data blob of a filestore row,
+# returns the sha1 of the written data
+def __write_filestore_data(filestore_id, chunks, filesize):
+    data_hash = hashlib.sha1()
+    written = 0
+    with source_conn.blobopen("filestore", "data", filestore_id) as blob:
+        for data in chunks:
+            if written+len(data) > filesize:
+                raise Exception("Error: Got more than the expected %s bytes for filestore_id %s." % (filesize, filestore_id))
+            blob.write(data)
+            data_hash.update(data)
+            written += len(data)
+
+    if written != filesize:
+        raise Exception("Error: Got %s of the expected %s bytes for filestore_id %s." % (written, filesize, filestore_id))
+
+    return data_hash.hexdigest()
+
+# writes chunks into the content addressed filestore_dir, returns the sha1
+# and the path of the file, relative to the source if it is below it
+def __write_filestore_file(chunks, filesize):
+    data_hash = hashlib.sha1()
+    written = 0
+    fd, filename = tempfile.mkstemp(prefix=".tmp-", dir=filestore_dir)
+    try:
+        with os.fdopen(fd, "wb") as fl:
+            for data in chunks:
+                fl.write(data)
+                data_hash.update(data)
+                written += len(data)
+
+        if written != filesize:
+            raise Exception("Error: Got %s of the expected %s bytes." % (written, filesize))
+
+        data_hash = data_hash.hexdigest()
+        path = os.path.join(filestore_dir, data_hash[0:2], data_hash[2:4], data_hash)
+        if os.path.exists(path):
+            # same content is already stored
+            os.remove(filename)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(filename, path)
+    except Exception as e:
+        if os.path.exists(filename):
+            os.remove(filename)
+        raise e
+
+    return (data_hash, __filestore_data_path(path))
+
+# data_path for a file in filestore_dir, relative to the source if the
+# filestore is below it
+def __filestore_data_path(path):
+    data_path = os.path.relpath(path, source_dir)
+    if data_path.startswith(".."):
+        data_path = path
+    return data_path
+
+# stores the eas ids block by block like __store_eas_id, with a pool of
+# "parallel" threads: the versions of the next block are fetched while the
+# files of the current block are downloaded. only this thread writes to
+# source_conn.
+def __store_eas_ids_pipelined (
+    name, # name of source
+    url,  # url of eas
+    instance, # instance of eas
+    blocks, # list of (eas_ids, source_unique_ids)
+    table_name, # table name in source
+    column_name,  # column in source
+    eas_versions,
+    parallel,
+    cache
+    ):
+
+    global source_conn
+
+    http = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=parallel, pool_maxsize=parallel)
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+
+    sql = source_conn.cursor()
+    window = parallel*4
+
+    def plan(block):
+        return __plan_eas_id(
+            http = http,
+            name = name,
+            instance = instance,
+            url = url,
+            eas_id = block[0],
+            table_name = table_name,
+            source_unique_id = block[1],
+            column_name = column_name,
+            eas_versions = eas_versions,
+            cache = cache
+            )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+        next_plan = None
+        if len(blocks) > 0:
+            next_plan = executor.submit(plan, blocks[0])
+
+        for idx in range(len(blocks)):
+            stats = __telemetry_record("assets", "%s.%s[%d]" % (table_name, column_name, idx))
+            stats["rows"] = len(blocks[idx][0])
+
+            start = time.perf_counter()
+            (jobs, ok) = next_plan.result()
+            stats["fetch_time"] += time.perf_counter() - start
+            if idx+1 < len(blocks):
+                next_plan = executor.submit(plan, blocks[idx+1])
+
+            # download every file once, only if it is not in the filestore yet
+            downloads = {}
+            def submit(job):
+                if "data" not in job["store_as"] or job["url"].startswith("file://"):
+                    return
+                if job["file_unique_id"] in downloads:
+                    return
+                __execute(sql, """SELECT filestore_id FROM filestore WHERE unique_id=?""", [job["file_unique_id"]])
+                if sql.fetchone():
+                    return
+                downloads[job["file_unique_id"]] = executor.submit(__download_to_tempfile, http, job["url"])
+
+            try:
+                for job in jobs[:window]:
+                    submit(job)
+
+                for (job_idx, job) in enumerate(jobs):
+                    if job_idx+window < len(jobs):
+                        submit(jobs[job_idx+window])
+
+                    download = downloads.pop(job["file_unique_id"], None)
+                    if download != None:
+                        start = time.perf_counter()
+                        download = download.result()
+                        stats["fetch_time"] += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    __store_eas_file(cache, job, download=download, stats=stats)
+                    stats["insert_time"] += time.perf_counter() - start
+            finally:
+                # remove downloads which were not stored
+                for download in downloads.values():
+                    try:
+                        os.remove(download.result()[0])
+                    except Exception:
+                        pass
+
+            __telemetry_finish(stats)
+
+    sql.close()
+    http.close()
+
+# stores file as blob from url
+def __store_file_from_url (
+    name,              # name of source
+    url,               # url to fetch data from
+    source_table_name, # table this is meant for
+    source_unique_id,  # row in table this is meant for
+    source_column_name,# column in table this is meant for
+    file_unique_id,    # a unique id provided to store the file
+    eas_id = None,     # optional eas-id
+    eas_root_id = None,# optional eas-root-id
+    file_version = None,# optional version
+    original_filename = None, # original_filename of file
+    store_as = ["data"], # allowed values are "data", "url", "file"
+    download = None # optional (filename, mimetype) of the already downloaded file, removed after use
+    ):
+
+    global silent
 
     if eas_id:
         info = "EAS-ID:"+str(eas_id)+" ["+file_version+"]"
     else:
         info = "URL:"+os.path.basename(url)
 
+    # size of the data stored, 0 for files already in the filestore
+    stored_size = 0
+
     sql = source_conn.cursor()
 
     # let's see if we already know the file
     __execute(sql, """SELECT filestore_id FROM filestore WHERE unique_id=?""", [file_unique_id])
 
-    for s_as in store_as:
-        if s_as in ["data", "url", "file"]:
-            if s_as == "file":
-                print("""Warning: store_as parameter "file" is currently unsupported. """)
-            continue
-        print("""Error: store_as parameter needs to be an Array of "data", "url", and/or "file".""")
-        sys.exit(1)
-
-    row = sql.fetchone()
-    if row:
-        filestore_id = row[0]
-        print("Notice: Re-used File: ", filestore_id, info) # ,r.headers
-    else:
-        mimetype = None
-        blobdata = None
-        filesize = None
-        extra_info = []
-
-        if "data" in store_as:
-            if url.startswith("file://"):
-                fn = url[7:] # cut of file
-                if not fn.startswith("/"): # relative path, add cwd
-                    fn = os.getcwd()+"/"+fn
-                    # print "file name", fn
-                    # print "file_unique_id", file_unique_id
+    req = None
+    spool = None
+    try:
+        for s_as in store_as:
+            if s_as in ["data", "url", "file"]:
+                if s_as == "file":
+                    print("""Warning: store_as parameter "file" is currently unsupported. """)
+                continue
+            print("""Error: store_as parameter needs to be an Array of "data", "url", and/or "file".""")
+            sys.exit(1)
 
-                fl = open(fn, 'rb')
+        row = sql.fetchone()
+        if row:
+            filestore_id = row[0]
+            print("Notice: Re-used File: ", filestore_id, info) # ,r.headers
+        else:
+            mimetype = None
+            filesize = None
+            chunks = None
+            extra_info = []
+
+            if "data" in store_as:
+                # the data is streamed into the blob in chunks, the size
+                # needs to be known before to preallocate it
+                if url.startswith("file://"):
+                    fn = url[7:] # cut of file
+                    if not fn.startswith("/"): # relative path, add cwd
+                        fn = os.getcwd()+"/"+fn
+                        # print "file name", fn
+                        # print "file_unique_id", file_unique_id
+
+                    mimetype = None
+                elif download != None:
+                    fn = download[0]
+                    mimetype = download[1]
+                else:
+                    req = requests.get(url, stream=True)
+                    mimetype = req.headers["content-type"]
+                    filesize = __response_size(req)
+                    if filesize != None:
+                        fn = None
+                        chunks = req.iter_content(blob_chunk_size)
+                    else:
+                        spool = __response_to_tempfile(req)
+                        fn = spool
 
-                with fl:
-                    data = fl.read()
+                if fn != None:
+                    filesize = os.path.getsize(fn)
+                    chunks = __file_chunks(fn)
 
-                mimetype = None
+            if url.startswith("file://"):
+                filename = url[7:]
             else:
-                req = requests.get(url)
-                mimetype = req.headers["content-type"]
-                data = req.content
+                filename = None
 
-            filesize = len(data)
-            blobdata = sqlite3.Binary(data)
+            data_hash = None
+            data_path = None
+            if chunks != None and filestore_dir != None:
+                (data_hash, data_path) = __write_filestore_file(chunks, filesize)
+                chunks = None
 
-        if url.startswith("file://"):
-            filename = url[7:]
-        else:
-            filename = None
+            if chunks != None and filesize > source_conn.getlimit(sqlite3.SQLITE_LIMIT_LENGTH):
+                print("Warning: File", info, "has", filesize, "bytes, more than a blob of the source can hold, data not stored. Use --filestore_dir for files of this size.")
+                chunks = None
 
-        __execute(sql, """INSERT INTO filestore (
-               unique_id,
-               original_filename,
-               filename,
-               url,
-               mimetype,
-               filesize,
-               data
-         ) VALUES (?,?,?,?,?,?,?)""", (
-                file_unique_id,
-                original_filename,
-                filename,
-                url,
-                mimetype,
-                filesize,
-                blobdata
-                ))
-
-        filestore_id = sql.lastrowid
-
-        if original_filename != None:
-            extra_info.append(original_filename)
-
-        if mimetype != None:
-            extra_info.append(str(mimetype))
-
-        if filesize != None:
-            extra_info.append(str(filesize)+"b")
-
-        if len(extra_info):
-            extra_info_txt = "("+",".join(extra_info)+")"
-        else:
-            extra_info_txt = ""
+            if chunks != None:
+                # preallocated and written below
+                data = "zeroblob(%d)" % filesize
+            else:
+                data = "NULL"
+
+            __execute(sql, """INSERT INTO filestore (
+                   unique_id,
+                   original_filename,
+                   filename,
+                   url,
+                   mimetype,
+                   filesize,
+                   data_hash,
+                   data_path,
+                   data
+             ) VALUES (?,?,?,?,?,?,?,?,%s)""" % data, (
+                    file_unique_id,
+                    original_filename,
+                    filename,
+                    url,
+                    mimetype,
+                    filesize,
+                    data_hash,
+                    data_path
+                    ))
+
+            filestore_id = sql.lastrowid
+
+            if chunks != None:
+                data_hash = __write_filestore_data(filestore_id, chunks, filesize)
+                __execute(sql, """UPDATE filestore SET data_hash=? WHERE filestore_id=?""", [data_hash, filestore_id])
+
+            if original_filename != None:
+                extra_info.append(original_filename)
+
+            if mimetype != None:
+                extra_info.append(str(mimetype))
+
+            if filesize != None:
+                extra_info.append(str(filesize)+"b")
+
+            if len(extra_info):
+                extra_info_txt = "("+",".join(extra_info)+")"
+            else:
+                extra_info_txt = ""
 
-        if not silent:
-            print("Notice: File:", filestore_id, extra_info_txt.encode("utf8"), "stored in filestore.", info)
+            if not silent:
+                print("Notice: File:", filestore_id, extra_info_txt.encode("utf8"), "stored in filestore.", info)
 
+            if data_hash != None:
+                stored_size = filesize
+    finally:
+        if req != None:
+            req.close()
+        if spool != None:
+            os.remove(spool)
+        if download != None:
+            os.remove(download[0])
 
     __execute(sql, """INSERT INTO file
             (filestore_id,
@@ -891,17 +2183,62 @@ def __store_file_from_url (
 
     sql.close()
 
-    return
+    return stored_size
 
 def __mysql_get_schema(conn,
                        include_tables=None,
                        include_tables_exclusive=True,
-                       exclude_tables=None):
+                       exclude_tables=None,
+                       schema_cache=None): # directory to keep the schema in, reused until the catalog changes
     cur = conn.cursor()
 
     cur.execute("SELECT DATABASE()")
     db_name = cur.fetchall()[0][0]
 
+    schema = None
+    if schema_cache != None:
+        cache_file = __mysql_schema_cache_file(cur, schema_cache, db_name)
+        schema = __read_schema_cache(cache_file)
+
+    if schema == None:
+        schema = __mysql_read_schema(cur, db_name)
+        if schema_cache != None:
+            __write_schema_cache(cache_file, schema)
+
+    __filter_schema(
+        schema=schema,
+        include_tables=include_tables,
+        include_tables_exclusive=include_tables_exclusive,
+        exclude_tables=exclude_tables
+        )
+
+    return schema
+
+# the cache file of a mysql schema. mysql has no catalog version, the
+# fingerprint is made of checksums over the tables, columns and primary key
+# columns of the database, computed by the server in one round trip.
+def __mysql_schema_cache_file(cur, schema_cache, db_name):
+    __execute(cur, """
+    SELECT
+      (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS(',', table_name, table_type, create_time))), 0))
+         FROM information_schema.TABLES
+         WHERE table_schema=DATABASE()),
+      (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS(',', table_name, column_name, ordinal_position, data_type))), 0))
+         FROM information_schema.COLUMNS
+         WHERE table_schema=DATABASE()),
+      (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS(',', table_name, column_name, seq_in_index))), 0))
+         FROM information_schema.STATISTICS
+         WHERE table_schema=DATABASE() AND index_name='PRIMARY'),
+      @@hostname,
+      @@port,
+      @@version""")
+    fingerprint = [__str_to_unicode(v) if isinstance(v, bytes) else str(v) for v in cur.fetchone()]
+
+    key = json.dumps([schema_cache_version, "mysql", __str_to_unicode(db_name), fingerprint])
+    return os.path.join(schema_cache, "mysql-%s.json" % hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+# reads the columns and primary keys of all tables from information_schema
+def __mysql_read_schema(cur, db_name):
     cur.execute("""
     SELECT table_name, column_name, data_type
          FROM INFORMATION_SCHEMA.COLUMNS
@@ -955,26 +2292,20 @@ def __mysql_get_schema(conn,
                 "type": data_type
                 })
 
-    for (tn, tb) in list(schema["tables"].items()):
-        cur.execute("""
-        SELECT column_name
-             FROM information_schema.key_column_usage k
-             WHERE table_schema=DATABASE()
-                AND constraint_name='PRIMARY'
-                AND table_name='%s'
-        ORDER BY table_name, ordinal_position""" % (tb["table_name"]))
-
-        tb["primary_keys"] = []
-        for pk_row in cur.fetchall():
-            tb["primary_keys"].append(pk_row[0])
+    # the primary keys of all tables at once
+    cur.execute("""
+    SELECT table_name, column_name
+         FROM information_schema.key_column_usage k
+         WHERE table_schema=DATABASE()
+            AND constraint_name='PRIMARY'
+    ORDER BY table_name, ordinal_position""")
 
+    primary_keys = {}
+    for pk_row in cur.fetchall():
+        primary_keys.setdefault(pk_row[0], []).append(pk_row[1])
 
-    __filter_schema(
-        schema=schema,
-        include_tables=include_tables,
-        include_tables_exclusive=include_tables_exclusive,
-        exclude_tables=exclude_tables
-        )
+    for (tn, tb) in list(schema["tables"].items()):
+        tb["primary_keys"] = primary_keys.get(tb["table_name"], [])
 
     return schema
 
@@ -1007,10 +2338,16 @@ def __human_size(size_bytes):
 def prepare_source (
     source="result.sqlite", # filename for the sqlite database file, where the results will be written into
     init=True, # set True and source will be purged
-    init_filestore=None # create crucial tables inside the target sqlite file
+    init_filestore=None, # create crucial tables inside the target sqlite file
+    external_filestore=None, # directory to write file data to instead of the sqlite file, relative to it
+    bulk_load=False, # load session: sqlite does not sync, indexes are created once their table is copied, ANALYZE in __commit_source
+    report=None # filename for the json run report written by __commit_source
     ):
 
     global source_conn
+    global source_dir
+    global filestore_dir
+    global bulk_load_session
 
     if init_filestore == None:
         if init == False:
@@ -1028,6 +2365,7 @@ def prepare_source (
     filename = __str_to_unicode(source)
 
     print("""Preparing source "%s" """ % filename, file=sys.stderr)
+    __telemetry_start(filename, report)
 
     if init and init_filestore:
         try:
@@ -1038,6 +2376,14 @@ def prepare_source (
 
     # FIXME: if Init==False: check for file existence!
 
+    source_dir = os.path.dirname(os.path.abspath(filename))
+    if external_filestore:
+        filestore_dir = os.path.join(source_dir, external_filestore)
+        os.makedirs(filestore_dir, exist_ok=True)
+        print("Notice: Writing file data to", filestore_dir)
+    else:
+        filestore_dir = None
+
     try:
         source_conn = sqlite3.connect(filename, detect_types=sqlite3.PARSE_DECLTYPES)
     except sqlite3.OperationalError as e:
@@ -1049,6 +2395,23 @@ def prepare_source (
     version = source_conn.execute("""SELECT sqlite_version()""").fetchone()[0]
     print("""Sqlite %s, Version: %s connected.""" % (filename, version))
 
+    if bulk_load:
+        # the write ahead log keeps the source intact if the process dies,
+        # a crash of the system may lose it
+        source_conn.execute("""PRAGMA journal_mode=WAL""")
+        source_conn.execute("""PRAGMA synchronous=OFF""")
+        source_conn.execute("""PRAGMA cache_size=-%d""" % (bulk_load_cache_size // 1024))
+        source_conn.execute("""PRAGMA mmap_size=%d""" % bulk_load_mmap_size)
+        source_conn.execute("""PRAGMA temp_store=MEMORY""")
+        # the base indexes are created at the end, also if an earlier
+        # session did not get there
+        bulk_load_session = {
+            "indexes": list(source_indexes)
+            }
+        print("Notice: Bulk load session, indexes are created after the load.")
+    else:
+        bulk_load_session = None
+
     if init:
         if not init_filestore:
             sql = source_conn.cursor()
@@ -1083,10 +2446,6 @@ def prepare_source (
                node_data TEXT
            )""")
 
-            __execute(source_conn, """CREATE INDEX xmldata_idx ON xmldata (
-               node_id_path
-        )""")
-
             source_conn.execute("""CREATE TABLE IF NOT EXISTS "xmldata.transcribed" (
                node_id_path TEXT NOT NULL,
                node_element_path TEXT NOT NULL
@@ -1124,12 +2483,9 @@ def prepare_source (
             )""")
 
 
-        __execute(source_conn, """CREATE INDEX file_idx ON file (
-               source_name,
-               source_table_name,
-               source_column_name,
-               source_unique_id
-        )""")
+        if bulk_load_session == None:
+            for (table_name, cmd) in source_indexes:
+                __execute(source_conn, cmd)
 
         __execute(source_conn, """CREATE TABLE filestore (
                filestore_id INTEGER PRIMARY KEY,
@@ -1139,10 +2495,31 @@ def prepare_source (
                filesize INTEGER,
                url TEXT,
                filename TEXT,
-               data BLOB
+               data BLOB,
+               data_hash TEXT,
+               data_path TEXT
             )""")
 
         print("Notice: Created Filestore Tables:", filename)
+    else:
+        __upgrade_filestore()
+
+# columns added to the filestore after its first version, sources created
+# before get them on prepare_source
+filestore_upgrade_columns = [
+    ("data_hash", "TEXT"), # sha1 of data
+    ("data_path", "TEXT") # file with the data, if not stored in data
+]
+
+def __upgrade_filestore():
+    columns = [row[1] for row in source_conn.execute("""PRAGMA table_info(filestore)""")]
+    if len(columns) == 0:
+        return
+
+    for (column, column_type) in filestore_upgrade_columns:
+        if column not in columns:
+            print("Notice: Adding column", column, "to filestore.")
+            __execute(source_conn, """ALTER TABLE filestore ADD COLUMN "%s" %s""" % (column, column_type))
 
 # remove all data from the source for a
 # specific name
@@ -1164,15 +2541,52 @@ def remove_from_source (
         tntpl = (row[0], row[1])
         __execute(sql, """DROP TABLE IF EXISTS "%s.%s" """ % tntpl)
 
+    data_paths = []
     if not keep_filestore:
+        # the file rows reference the filestore, remove them first and keep
+        # the files still used by other sources
+        __execute(sql, """
+             CREATE TEMP TABLE remove_filestore AS
+             SELECT DISTINCT filestore_id FROM file WHERE source_name=?""", [name])
+        __execute(sql, """DELETE FROM file WHERE source_name=?""", [name])
+        __execute(sql, """
+             DELETE FROM remove_filestore
+             WHERE filestore_id IN (SELECT filestore_id FROM file)""")
+
+        __execute(sql, """
+             SELECT DISTINCT data_path FROM filestore
+             WHERE data_path IS NOT NULL AND filestore_id IN (
+                SELECT filestore_id FROM remove_filestore
+             )""")
+        data_paths = [row[0] for row in sql.fetchall()]
+
         __execute(sql, """
              DELETE FROM filestore
              WHERE filestore_id IN (
-                SELECT filestore_id FROM file WHERE source_name=?
-             )""", [name])
-        __execute(sql, """DELETE FROM file WHERE source_name=?""", [name])
+                SELECT filestore_id FROM remove_filestore
+             )""")
+        __execute(sql, """DROP TABLE remove_filestore""")
     __execute(sql, """DELETE FROM origin WHERE source_name=?""", [name])
 
+    __execute(sql, """SELECT name FROM sqlite_master WHERE type='table' AND name='incremental'""", [])
+    if sql.fetchone():
+        __execute(sql, """DELETE FROM incremental WHERE source_name=?""", [name])
+        __execute(sql, """DELETE FROM incremental_deleted WHERE source_name=?""", [name])
+
+    __execute(sql, """SELECT name FROM sqlite_master WHERE type='table' AND name='copy_checkpoint'""", [])
+    if sql.fetchone():
+        __execute(sql, """DELETE FROM copy_checkpoint WHERE substr(table_name_in_source, 1, length(?)+1) = ? || '.'""", [name, name])
+
+    # remove files which are not used by other files in the filestore
+    for data_path in data_paths:
+        __execute(sql, """SELECT 1 FROM filestore WHERE data_path=? LIMIT 1""", [data_path])
+        if sql.fetchone():
+            continue
+        try:
+            os.remove(os.path.join(source_dir, data_path))
+        except OSError as e:
+            print("Warning: Unable to remove", data_path, "from filestore:", e)
+
 def pg_to_source(
     name,
     dsn,
@@ -1181,41 +2595,291 @@ def pg_to_source(
     include_tables=None,
     include_tables_exclusive=True,
     include_schema_in_table_name=True,
-    exclude_tables=None
+    exclude_tables=None,
+    pagination="keyset",
+    parallel=None, # number of tables copied at once on separate connections
+    reader="cursor", # "cursor" or "copy", copy streams every table with one COPY statement
+    streaming=True, # use server side cursors
+    itersize=None, # rows per fetch of a server side cursor, defaults to stream_itersize
+    incremental=False, # copy only rows changed since the last incremental run, see __pg_incremental_tables
+    change_columns=None, # column name, or {table name: column name}, used as watermark instead of xmin
+    resume=False, # continue the copy of an earlier run after its checkpoints, see __start_copy_checkpoint
+    schema_cache=None # directory to cache the schema in, see __pg_schema_cache_file
     ):
     conn = psycopg2.connect(dsn)
+
+    if incremental and limit != None:
+        print("""Error: incremental copies need limit None.""")
+        sys.exit(1)
+
+    if incremental or (parallel != None and parallel > 1):
+        # the watermarks are taken from the same snapshot the rows are read from
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+
+    snapshot = None
+    if parallel != None and parallel > 1:
+        # all workers import the snapshot of this transaction, so the copy
+        # is consistent. the transaction stays open until the copy is done.
+        cur = conn.cursor()
+        cur.execute("SELECT pg_export_snapshot()")
+        snapshot = cur.fetchone()[0]
+        print("Notice: Exported snapshot", snapshot, "for", parallel, "workers.")
+
     register_cast_date(conn)
 
-    schema = __pg_get_schema(conn=conn, schema_name=schema_name, include_tables=include_tables, include_schema_in_table_name=include_schema_in_table_name, include_tables_exclusive=include_tables_exclusive, exclude_tables=exclude_tables)
-    __create_schema_in_source(name=name, schema=schema)
-    __copy_data_to_source(conn=conn, schema=schema, limit=limit)
+    def connect():
+        worker_conn = psycopg2.connect(dsn)
+        worker_conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        worker_conn.cursor().execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+        return worker_conn
+
+    schema = __pg_get_schema(conn=conn, schema_name=schema_name, include_tables=include_tables, include_schema_in_table_name=include_schema_in_table_name, include_tables_exclusive=include_tables_exclusive, exclude_tables=exclude_tables, schema_cache=schema_cache)
+    if incremental:
+        increments = __pg_incremental_tables(conn=conn, name=name, schema=schema, change_columns=change_columns)
+    elif resume:
+        __resume_schema_in_source(name=name, schema=schema)
+    else:
+        __create_schema_in_source(name=name, schema=schema)
+    __copy_data_to_source(conn=conn, schema=schema, limit=limit, pagination=pagination, parallel=parallel, connect=connect, reader=reader, streaming=streaming, itersize=itersize, resume=resume)
+    if incremental:
+        __pg_incremental_finish(conn=conn, name=name, schema=schema, increments=increments)
     conn.close()
 
+# watermarks of incremental copies, and the rows deleted in the origin since
+def __create_incremental_tables():
+    global source_conn
+
+    source_conn.execute("""CREATE TABLE IF NOT EXISTS incremental (
+       source_name TEXT NOT NULL,
+       source_table_name TEXT NOT NULL,
+       change_column TEXT NOT NULL,
+       watermark TEXT,
+       extracted_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+       PRIMARY KEY(source_name, source_table_name)
+    )""")
+
+    source_conn.execute("""CREATE TABLE IF NOT EXISTS incremental_deleted (
+       source_name TEXT NOT NULL,
+       source_table_name TEXT NOT NULL,
+       source_unique_id TEXT NOT NULL,
+       deleted_time DATETIME DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+# prepares the tables of an incremental copy. tables copied before keep
+# their rows, only rows changed since the watermark of the last run are
+# selected and replace the rows with the same __source_unique_id. the
+# watermark is the maximum of the change column, or the xmin of the
+# snapshot for tables without change column: rows written later have a
+# newer xmin. changed rows get a new __source_inserted_time.
+#
+# new tables, tables with changed columns and tables without primary key
+# are copied completely. returns the watermarks to store once the rows
+# are copied.
+def __pg_incremental_tables(conn, name, schema, change_columns):
+    global source_conn
+
+    __create_incremental_tables()
+
+    cur = conn.cursor()
+    sql = source_conn.cursor()
+    source_name = name.lower()
+
+    cur.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+    snapshot_xmin = str(cur.fetchone()[0])
+
+    increments = {}
+    for (tn, tb) in list(schema["tables"].items()):
+        column_names = [column["name"] for column in tb["columns"]]
+
+        if isinstance(change_columns, dict):
+            change_column = change_columns.get(tn)
+            if change_column != None and change_column not in column_names:
+                print("Warning: Change column", change_column, "not found in", tn, "using xmin.")
+                change_column = None
+        elif change_columns in column_names:
+            change_column = change_columns
+        else:
+            change_column = None
+
+        if change_column != None:
+            __execute(cur, """SELECT max("%s")::text FROM %s""" % (change_column, tb["table_name_select_escaped"]))
+            watermark = cur.fetchone()[0]
+        else:
+            __execute(cur, """SELECT relkind FROM pg_class WHERE oid = %s::regclass""", [tb["table_name_select_escaped"]])
+            if cur.fetchone()[0] not in ("r", "p"):
+                # views have no xmin, they are copied completely every time
+                print("Notice:", tn, "has no xmin, copying all rows.")
+                watermark = None
+            else:
+                watermark = snapshot_xmin
+
+        source_table_name = __origin_source_table(name, schema, tn)
+
+        last_watermark = None
+        if source_table_name == None:
+            __create_table_in_source(
+                origin_database_name = schema["database"],
+                origin_type = schema["type"],
+                source_name = name,
+                origin_table_name = tn,
+                table_def = tb
+                )
+        else:
+            tb["table_name_in_source"] = source_name+"."+source_table_name
+
+            __execute(sql, """PRAGMA table_info("%s")""" % tb["table_name_in_source"])
+            columns = [(r[1], r[2]) for r in sql.fetchall() if r[1] not in ("__source_unique_id", "__source_inserted_time")]
+
+            if columns != [(column["name"], column["type"]) for column in tb["columns"]]:
+                print("Notice: Columns of", tn, "changed, copying all rows.")
+                __create_table_in_source(
+                    origin_database_name = schema["database"],
+                    origin_type = schema["type"],
+                    source_name = source_name,
+                    origin_table_name = tn,
+                    table_def = tb,
+                    source_table_name = source_table_name
+                    )
+            elif len(tb["primary_keys"]) == 0:
+                print("Notice:", tn, "has no primary key, copying all rows.")
+                tb["replace"] = True
+            else:
+                tb["upsert"] = True
+                __execute(sql, """
+     SELECT change_column, watermark FROM incremental WHERE
+        source_name = ? AND
+        source_table_name = ?""", [source_name, source_table_name])
+                wrow = sql.fetchone()
+                if wrow != None and wrow[0] == (change_column or "xmin"):
+                    last_watermark = wrow[1]
+
+        increments[tn] = {
+            "source_table_name": tb["table_name_in_source"][len(source_name)+1:],
+            "change_column": change_column or "xmin",
+            "watermark": watermark,
+            "where": tb.get("where")
+            }
+
+        if last_watermark == None:
+            if tb.get("upsert"):
+                print("Notice: No watermark for", tn, "copying all rows.")
+            continue
+
+        if change_column != None:
+            # rows with the watermark value may have been written after the last run
+            changed = cur.mogrify('"%s" >= %%s' % change_column, [last_watermark])
+        else:
+            # age() counts back from the current transaction, so the xid wraparound does not matter
+            changed = cur.mogrify("age(xmin) <= age(%s::xid)", [str(int(last_watermark) % 2**32)])
+        changed = changed.decode("utf-8")
+
+        if tb.get("where"):
+            tb["where"] = "("+tb["where"]+") AND "+changed
+        else:
+            tb["where"] = changed
+
+    sql.close()
+    source_conn.commit()
+    return increments
+
+# removes the rows of upserted tables whose primary key is no longer in the
+# origin, lists them in incremental_deleted and stores the new watermarks
+def __pg_incremental_finish(conn, name, schema, increments):
+    global source_conn
+
+    sql = source_conn.cursor()
+    source_name = name.lower()
+
+    for (tn, tb) in list(schema["tables"].items()):
+        increment = increments[tn]
+        if tb.get("upsert"):
+            tb["where"] = increment["where"]
+            deleted = __pg_incremental_deletions(conn, source_name, tb, increment["source_table_name"])
+            print("Notice:", tb["table_name_in_source"], deleted, "rows deleted.")
+
+        __execute(sql, """
+     INSERT OR REPLACE INTO incremental
+          (source_name, source_table_name, change_column, watermark)
+          VALUES (?,?,?,?)
+     """, [source_name, increment["source_table_name"], increment["change_column"], increment["watermark"]])
+
+    sql.close()
+    source_conn.commit()
+
+def __pg_incremental_deletions(conn, source_name, tb, source_table_name):
+    global source_conn
+
+    sql = source_conn.cursor()
+    __execute(sql, """CREATE TEMP TABLE incremental_keys (source_unique_id TEXT PRIMARY KEY)""")
+
+    where = ""
+    if tb.get("where"):
+        where = "WHERE "+tb["where"]
+
+    # only the primary keys are read, the rows themselves stay in the origin
+    pk_columns = ",".join(['"'+pk+'"' for pk in tb["primary_keys"]])
+    cur = __origin_cursor(conn, {"streaming": "postgresql", "itersize": stream_itersize})
+    __execute(cur, """SELECT %s FROM %s %s""" % (pk_columns, tb["table_name_select_escaped"], where))
+
+    writer = __bulk_writer()
+    for row in cur:
+        __bulk_write(writer, """INSERT INTO temp.incremental_keys VALUES (?)""", ["-".join([__value_to_unicode(v) for v in row])])
+    __bulk_close(writer)
+    cur.close()
+
+    deleted_rows = """
+     FROM "%s" WHERE __source_unique_id NOT IN (
+        SELECT source_unique_id FROM temp.incremental_keys
+     )""" % tb["table_name_in_source"]
+
+    __execute(sql, """
+     INSERT INTO incremental_deleted
+          (source_name, source_table_name, source_unique_id)
+          SELECT ?, ?, __source_unique_id"""+deleted_rows, [source_name, source_table_name])
+    deleted = sql.rowcount
+    __execute(sql, """DELETE"""+deleted_rows, [])
+    __execute(sql, """DROP TABLE temp.incremental_keys""")
+    sql.close()
+    source_conn.commit()
+    return deleted
+
 def sqlite_to_source(
     name,
     filename,
     limit=None,
     include_tables=None,
     include_tables_exclusive=True,
-    exclude_tables=None
+    exclude_tables=None,
+    pagination="keyset",
+    resume=False # continue the copy of an earlier run after its checkpoints
     ):
 
     conn = sqlite3.connect(filename, detect_types=sqlite3.PARSE_DECLTYPES)
     schema = __sqlite_get_schema(conn=conn, include_tables=include_tables, include_tables_exclusive=include_tables_exclusive, exclude_tables=exclude_tables)
-    __create_schema_in_source(name=name, schema=schema)
+    if resume:
+        __resume_schema_in_source(name=name, schema=schema)
+    else:
+        __create_schema_in_source(name=name, schema=schema)
     # we use a byte string here, so we can detect
     # the correct charset
     conn.text_factory = bytes
-    __copy_data_to_source(conn=conn, schema=schema, limit=limit)
+    __copy_data_to_source(conn=conn, schema=schema, limit=limit, pagination=pagination, resume=resume)
     conn.close()
 
-def eas_to_source (name, url, instance, eas_versions):
+def eas_to_source (
+    name,
+    url,
+    instance,
+    eas_versions,
+    parallel=None # number of threads fetching versions and downloading files
+    ):
     global source_conn
 
     print("Notice: Loading data from EAS:", url, "Instance: ", instance, "Versions:", repr(eas_versions))
 
     sql = source_conn.cursor()
     sql2 = source_conn.cursor()
+    cache = __eas_cache()
     sql.execute("""SELECT table_name, name FROM "%s.eadb_columns" WHERE type='easfile'"""%(name))
     eas_cols = 0
     for row in sql.fetchall():
@@ -1235,39 +2899,52 @@ def eas_to_source (name, url, instance, eas_versions):
         cmd = """SELECT "%s", __source_unique_id FROM "%s.%s" WHERE "%s" > 0 AND "%s" != '%s' """ % (column_name, name, source_table_name, column_name, column_name, column_name)
         print("Notice: Importing %s.%s..." %(table_name, column_name))
         __execute(sql2, cmd)
-        count = 0
+        blocks = []
         eas_ids = []
         source_unique_ids = []
         for row2 in sql2.fetchall():
-            count += 1
             eas_ids.append(row2[0])
             source_unique_ids.append(row2[1])
 
             if len(eas_ids) == 1000:
-                __store_eas_id(
-                    name = name,
-                    instance = instance,
-                    url = url,
-                    eas_id = eas_ids,
-                    table_name = source_table_name, #table_name,
-                    source_unique_id = source_unique_ids,
-                    column_name = column_name,
-                    eas_versions = eas_versions
-                    )
+                blocks.append((eas_ids, source_unique_ids))
                 eas_ids = []
                 source_unique_ids = []
 
         if len(eas_ids) > 0:
-            __store_eas_id(
+            blocks.append((eas_ids, source_unique_ids))
+
+        count = sum([len(block[0]) for block in blocks])
+
+        if parallel != None and parallel > 1:
+            __store_eas_ids_pipelined(
                 name = name,
                 instance = instance,
                 url = url,
-                eas_id = eas_ids,
+                blocks = blocks,
                 table_name = source_table_name, #table_name,
-                source_unique_id = source_unique_ids,
                 column_name = column_name,
-                eas_versions = eas_versions
+                eas_versions = eas_versions,
+                parallel = parallel,
+                cache = cache
                 )
+        else:
+            for (idx, (eas_ids, source_unique_ids)) in enumerate(blocks):
+                stats = __telemetry_record("assets", "%s.%s[%d]" % (source_table_name, column_name, idx))
+                stats["rows"] = len(eas_ids)
+                __store_eas_id(
+                    name = name,
+                    instance = instance,
+                    url = url,
+                    eas_id = eas_ids,
+                    table_name = source_table_name, #table_name,
+                    source_unique_id = source_unique_ids,
+                    column_name = column_name,
+                    eas_versions = eas_versions,
+                    cache = cache,
+                    stats = stats
+                    )
+                __telemetry_finish(stats)
 
         print("Notice: Done Importing %s.%s. Imported %s files." %(table_name, column_name, count))
 
@@ -1286,16 +2963,32 @@ def mysql_to_source(
     limit=None,
     include_tables=None,
     include_tables_exclusive=True,
-    exclude_tables=None
+    exclude_tables=None,
+    pagination="keyset",
+    parallel=None, # number of tables copied at once on separate connections
+    streaming=True, # use unbuffered server side cursors
+    resume=False, # continue the copy of an earlier run after its checkpoints
+    schema_cache=None # directory to cache the schema in
     ):
 
     conn = MySQLdb.connect(host=host, db=db, user=user, passwd=passwd)
 
     conn.cursor().execute("SET SQL_MODE=ANSI_QUOTES;")
 
-    schema = __mysql_get_schema(conn=conn, include_tables=include_tables, include_tables_exclusive=include_tables_exclusive, exclude_tables=exclude_tables)
-    __create_schema_in_source(name=name, schema=schema)
-    __copy_data_to_source(conn=conn, schema=schema, limit=limit)
+    def connect():
+        # mysql can not share a snapshot between connections, every worker
+        # reads from its own consistent snapshot
+        worker_conn = MySQLdb.connect(host=host, db=db, user=user, passwd=passwd)
+        worker_conn.cursor().execute("SET SQL_MODE=ANSI_QUOTES;")
+        worker_conn.cursor().execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        return worker_conn
+
+    schema = __mysql_get_schema(conn=conn, include_tables=include_tables, include_tables_exclusive=include_tables_exclusive, exclude_tables=exclude_tables, schema_cache=schema_cache)
+    if resume:
+        __resume_schema_in_source(name=name, schema=schema)
+    else:
+        __create_schema_in_source(name=name, schema=schema)
+    __copy_data_to_source(conn=conn, schema=schema, limit=limit, pagination=pagination, parallel=parallel, connect=connect, streaming=streaming, resume=resume)
     conn.close()
 
 def get_source_conn():
@@ -1316,10 +3009,11 @@ def csv_to_source (
     filename,         # csv filename
     columns=None,     # columns array with "name" and "type" as keys, defaults to first row in csv
     table_name=None,  # table name in source, defaults to filename's basename
-    dialect="detect"  # csv dialect
+    dialect="detect", # csv dialect
+    infer_types=False, # use INTEGER and REAL for the columns from the first row, if all values fit
+    parallel=None     # number of worker processes parsing byte ranges of the file, None parses in this process
     ):
     global source_conn
-    sql = source_conn.cursor()
 
     print("Notice: Reading CSV file", "\""+filename+"\"", "Dialect:", dialect)
 
@@ -1340,6 +3034,7 @@ def csv_to_source (
     csvfile = open(filename, 'r')
     reader = csv.reader(csvfile, _dialect)
     row_count = 0
+    infer = False
     if columns == None:
         header = next(reader)
         columns = []
@@ -1352,16 +3047,58 @@ def csv_to_source (
 
             columns.append({"name": escape_col(cn), "type": "TEXT"})
         row_count += 1
+        infer = infer_types
 
     if table_name == None:
         table_name = os.path.basename(filename)
 
-    qms = ["?"]
-    column_names = []
-    for column in columns:
-        qms.append("?")
-        column_names.append('"'+column["name"]+'"')
+    if parallel != None and parallel > 1:
+        csvfile.close()
+        if __csv_to_source_parallel(name, filename, columns, table_name, _dialect, row_count, infer, parallel):
+            return
+
+        # parse the file in this process
+        csvfile = open(filename, 'r')
+        reader = csv.reader(csvfile, _dialect)
+        if row_count > 0:
+            next(reader)
+
+    rows = reader
+    if infer:
+        sample = list(itertools.islice(reader, csv_sample_rows))
+        kinds = __csv_kinds(sample, len(columns))
+        for (column, kind) in zip(columns, kinds):
+            if kind != None:
+                column["type"] = kind
+        rows = itertools.chain(sample, reader)
+
+    table_def = __csv_create_table(name, filename, table_name, columns)
+    insert = __csv_insert(table_def)
+
+    # columns with INTEGER or REAL, values not fitting make them TEXT
+    typed = [(idx+1, column) for (idx, column) in enumerate(columns) if column["type"] in ("INTEGER", "REAL")]
+
+    writer = __bulk_writer()
+    for row in rows:
+        bindings = __csv_bindings(row, row_count, len(columns))
+
+        for (idx, column) in typed:
+            value = bindings[idx]
+            if value != "" and column["type"] != "TEXT" and __csv_kind(value) != column["type"]:
+                __bulk_flush(writer)
+                print("Notice: Column", "\""+column["name"]+"\"", "changed from", column["type"], "to TEXT, found", repr(value), "in row", row_count)
+                column["type"] = "TEXT"
+                __csv_retype_table(name, filename, table_name, table_def)
+                typed = [(i, c) for (i, c) in typed if c["type"] != "TEXT"]
+
+        __bulk_write(writer, insert, bindings)
+
+        row_count += 1
 
+    __bulk_close(writer)
+    csvfile.close()
+
+def __csv_create_table(name, filename, table_name, columns):
     table_def = {
         "columns": columns,
         "primary_keys": []
@@ -1375,143 +3112,475 @@ def csv_to_source (
         origin_table_name = table_name
         )
 
-    insert = format_insert(table_def, column_names, qms)
+    return table_def
 
-    for row in reader:
-        bindings = []
-        bindings.append(row_count)
-        for s in row:
-            if len(bindings) == len(qms):
-                print("Warning: Too many columns found in row %s, ignoring additional columns." % row_count)
+def __csv_insert(table_def):
+    return format_insert(table_def, ['"'+column["name"]+'"' for column in table_def["columns"]], ["?"]*(len(table_def["columns"])+1))
+
+# returns the bindings for a csv row, after the __source_unique_id one value
+# per column, missing values are filled with "". rows with too many values
+# are reported, or added to warnings.
+def __csv_bindings(row, row_count, column_count, warnings=None):
+    if len(row) > column_count:
+        if warnings == None:
+            print("Warning: Too many columns found in row %s, ignoring additional columns." % row_count)
+        else:
+            warnings.append(row_count)
+        return [row_count] + row[:column_count]
+
+    bindings = [row_count] + row
+    if len(row) < column_count:
+        # fill with space
+        bindings.extend([""] * (column_count - len(row)))
+    return bindings
+
+csv_integer_re = re.compile(r"-?(0|[1-9][0-9]*)\Z")
+csv_real_re = re.compile(r"-?(0|[1-9][0-9]*)\.[0-9]+\Z")
+
+# returns the type sqlite stores value as without changing it: INTEGER and
+# REAL only for values which are written back the same ("7", "1.5", not
+# "007", "1.50" or "1e5")
+def __csv_kind(value):
+    if csv_integer_re.match(value):
+        if value != "-0" and -2**63 <= int(value) < 2**63:
+            return "INTEGER"
+        return "TEXT"
+
+    if csv_real_re.match(value):
+        number = float(value)
+        # sqlite keeps 15 significant digits when converting to text
+        if repr(number) == value and number != 0 and len(value.lstrip("-").replace(".", "").lstrip("0")) <= 15:
+            return "REAL"
+    return "TEXT"
+
+# merges the type of a column in two parts of a file, None if only empty
+# values were seen
+def __csv_merge_kind(kind, other):
+    if kind == None:
+        return other
+    if other == None or other == kind:
+        return kind
+    return "TEXT"
+
+# returns the type for each column of rows, None for columns with only empty values
+def __csv_kinds(rows, column_count, kinds=None):
+    if kinds == None:
+        kinds = [None] * column_count
+
+    # columns which are not TEXT yet
+    open_columns = list(range(column_count))
+    for row in rows:
+        for idx in open_columns:
+            if idx >= len(row) or row[idx] == "":
+                continue
+            kinds[idx] = __csv_merge_kind(kinds[idx], __csv_kind(row[idx]))
+        if "TEXT" in kinds:
+            open_columns = [idx for idx in open_columns if kinds[idx] != "TEXT"]
+            if len(open_columns) == 0:
                 break
-            bindings.append(__value_to_unicode(s))
+    return kinds
 
-        if len(bindings) < len(qms):
-            # fill with space
-            for i in range(0, len(qms)-len(bindings)):
-                bindings.append("")
+# sqlite can not change the type of a column, so the table is created with
+# the types of table_def and the rows are copied
+def __csv_retype_table(name, filename, table_name, table_def):
+    global source_conn
 
-        try:
-            __execute(sql, insert, bindings)
-        except Exception as e:
-            print("Row["+str(row_count)+"]:", row)
-            raise e
+    table_name_in_source = table_def["table_name_in_source"]
+    cursor = source_conn.cursor()
+    __execute(cursor, """ALTER TABLE "%s" RENAME TO "%s.retype" """ % (table_name_in_source, table_name_in_source))
+
+    __create_table_in_source(
+        origin_database_name = os.path.abspath(filename),
+        origin_type = "csv",
+        source_name = name.lower(),
+        table_def = table_def,
+        origin_table_name = table_name,
+        source_table_name = table_name_in_source[len(name)+1:]
+        )
+
+    __execute(cursor, """INSERT INTO "%s" SELECT * FROM "%s.retype" """ % (table_name_in_source, table_name_in_source))
+    __execute(cursor, """DROP TABLE "%s.retype" """ % table_name_in_source)
+    source_conn.commit()
+    cursor.close()
+
+# the csv file is split into byte ranges at line ends outside of quoted
+# values, worker processes parse the ranges into temporary sqlite databases,
+# which are copied into the source in order. returns False if the file
+# can not be split.
+def __csv_to_source_parallel(name, filename, columns, table_name, dialect, row_count, infer, parallel):
+    global source_conn
+
+    if dialect.escapechar != None:
+        print("Notice: CSV with escapechar is parsed in one process.")
+        return False
+
+    # the dialect of the sniffer can not be pickled
+    fmtparams = {}
+    for key in ("delimiter", "quotechar", "escapechar", "doublequote", "skipinitialspace", "lineterminator", "quoting"):
+        fmtparams[key] = getattr(dialect, key)
+    fmtparams["strict"] = getattr(dialect, "strict", False)
+
+    ranges = __csv_ranges(filename, dialect, parallel * 4)
+    if len(ranges) < 2:
+        return False
+
+    shard_dir = tempfile.mkdtemp(prefix="csv_shards_", dir=source_dir)
+    print("Notice: Parsing CSV in", len(ranges), "ranges with", parallel, "workers.")
+    sys.stdout.flush()
+
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=parallel, mp_context=multiprocessing.get_context("fork"))
+    try:
+        futures = []
+        for (idx, (start, end)) in enumerate(ranges):
+            shard_filename = os.path.join(shard_dir, "range_%d.sqlite" % idx)
+            futures.append(pool.submit(__csv_range_to_shard, filename, fmtparams, start, end, idx == 0 and row_count > 0, len(columns), infer, shard_filename))
+
+        results = []
+        kinds = [None] * len(columns)
+        for future in futures:
+            result = future.result()
+            if result == None:
+                print("Warning: Found a quote inside of an unquoted value, CSV is parsed in one process.")
+                pool.shutdown(wait=True, cancel_futures=True)
+                return False
+            results.append(result)
+            kinds = [__csv_merge_kind(kind, other) for (kind, other) in zip(kinds, result["kinds"])]
+
+        if infer:
+            for (column, kind) in zip(columns, kinds):
+                if kind != None:
+                    column["type"] = kind
+
+        table_def = __csv_create_table(name, filename, table_name, columns)
+        table_name_in_source = table_def["table_name_in_source"]
+        column_names = ",".join(['"%s"' % column["name"] for column in columns])
+        shard_columns = ",".join(["c%d" % (i+1) for i in range(len(columns))])
+
+        cursor = source_conn.cursor()
+        source_conn.commit()
+        for result in results:
+            for warning in result["warnings"]:
+                print("Warning: Too many columns found in row %s, ignoring additional columns." % (warning + row_count))
+
+            __execute(cursor, """ATTACH DATABASE ? AS csv_range""", [result["filename"]])
+            try:
+                __execute(cursor, """INSERT INTO "%s" (__source_unique_id, %s) SELECT c0 + ?, %s FROM csv_range.rows ORDER BY rowid""" % (
+                    table_name_in_source, column_names, shard_columns), [row_count])
+                source_conn.commit()
+            finally:
+                __execute(cursor, """DETACH DATABASE csv_range""", [])
+            os.remove(result["filename"])
+            row_count += result["rows"]
+        cursor.close()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    return True
+
+# returns (start, end) byte ranges of about the same size, which end after a
+# line end with an even number of quotes before it
+def __csv_ranges(filename, dialect, count):
+    size = os.path.getsize(filename)
+    range_size = max(csv_min_range_size, size // max(1, count))
+
+    quote = None
+    if dialect.quoting != csv.QUOTE_NONE and dialect.quotechar:
+        quote = dialect.quotechar.encode()
+
+    ranges = []
+    start = 0
+    pos = 0
+    quotes = 0
+    with open(filename, "rb") as f:
+        while start + range_size < size:
+            # count the quotes up to the planned end of the range
+            target = start + range_size
+            while pos < target:
+                data = f.read(min(blob_chunk_size, target - pos))
+                if quote:
+                    quotes += data.count(quote)
+                pos += len(data)
+
+            # move the end to the next line end outside of quotes
+            end = None
+            while end == None:
+                data = f.read(blob_chunk_size)
+                if not data:
+                    break
+                offset = 0
+                while True:
+                    nl = data.find(b"\n", offset)
+                    if nl < 0:
+                        if quote:
+                            quotes += data.count(quote, offset)
+                        pos += len(data)
+                        break
+                    if quote:
+                        quotes += data.count(quote, offset, nl)
+                    offset = nl + 1
+                    if quotes % 2 == 0:
+                        end = pos + offset
+                        f.seek(end)
+                        pos = end
+                        break
+
+            if end == None or end >= size:
+                break
+            ranges.append((start, end))
+            start = end
+
+    ranges.append((start, size))
+    return ranges
+
+# runs in a worker process, parses a byte range of a csv file into the table
+# "rows" of a new sqlite database, c0 is the number of the row in the range.
+# returns None if a record has an odd number of quotes, so the file can not
+# be split at line ends by quote parity.
+def __csv_range_to_shard(filename, fmtparams, start, end, skip_header, column_count, infer, shard_filename):
+    encoding = locale.getpreferredencoding(False)
+    quote = None
+    if fmtparams["quoting"] != csv.QUOTE_NONE and fmtparams["quotechar"]:
+        quote = fmtparams["quotechar"].encode()
+
+    # quotes of the lines read for the current record
+    state = {"quotes": 0}
+
+    def lines():
+        with open(filename, "rb") as f:
+            f.seek(start)
+            pos = start
+            while pos < end:
+                line = f.readline()
+                if not line:
+                    break
+                pos += len(line)
+                if quote:
+                    state["quotes"] += line.count(quote)
+                line = line.decode(encoding)
+                # like reading in text mode
+                if line.endswith("\r\n"):
+                    line = line[:-2] + "\n"
+                yield line
+
+    reader = csv.reader(lines(), **fmtparams)
+    if skip_header:
+        next(reader, None)
+        state["quotes"] = 0
+
+    conn = sqlite3.connect(shard_filename)
+    conn.execute("""CREATE TABLE rows (%s)""" % ",".join(["c%d" % i for i in range(column_count+1)]))
+    insert = """INSERT INTO rows VALUES (%s)""" % ",".join(["?"]*(column_count+1))
+
+    warnings = []
+    kinds = [None] * column_count
+    batch = []
+    row_count = 0
+    for row in reader:
+        if state["quotes"] % 2 != 0:
+            conn.close()
+            return None
+        state["quotes"] = 0
 
+        batch.append(__csv_bindings(row, row_count, column_count, warnings))
         row_count += 1
+        if len(batch) >= bulk_buffer_size:
+            if infer:
+                __csv_kinds([bindings[1:] for bindings in batch], column_count, kinds)
+            conn.executemany(insert, batch)
+            batch = []
+
+    if infer:
+        __csv_kinds([bindings[1:] for bindings in batch], column_count, kinds)
+    conn.executemany(insert, batch)
+    conn.commit()
+    conn.close()
 
-    csvfile.close()
+    return {
+        "filename": shard_filename,
+        "rows": row_count,
+        "kinds": kinds,
+        "warnings": warnings
+        }
 
 def excel_to_source (
     name,             # name in source
     filename,         # excel filename
-    table_name=None   # table name in source, defaults to filename's basename
+    table_name=None,  # table name in source, defaults to filename's basename
+    parallel=None     # number of worker processes reading sheets, None reads in this process
     ):
 
     global source_conn
-    sql = source_conn.cursor()
 
     if table_name is None:
         table_name = os.path.basename(filename)
 
     print("Notice: Reading excel file", "\""+filename+"\"")
 
-    wb = openpyxl.load_workbook(filename)
+    # read only mode streams the rows from the file instead of loading all
+    # cells of the workbook
+    wb = openpyxl.load_workbook(filename, read_only=True)
+    sheetnames = wb.sheetnames
 
-    for sheetname in wb.sheetnames:
-        print("Notice: Reading excel sheet", "\""+sheetname+"\"")
+    if parallel == None or parallel < 2 or len(sheetnames) < 2:
+        for sheetname in sheetnames:
+            print("Notice: Reading excel sheet", "\""+sheetname+"\"")
+            __excel_sheet_to_source(name, filename, table_name, sheetname, wb[sheetname].iter_rows(values_only=True))
+        wb.close()
+        return
 
-        sheet = wb[sheetname]
+    wb.close()
 
-        # iterate over all rows, use first row as header
-        header = []
+    # the workers write each sheet into a temporary sqlite database, which
+    # is copied into the source in the order of the sheets
+    shard_dir = tempfile.mkdtemp(prefix="excel_shards_", dir=source_dir)
+    print("Notice: Reading", len(sheetnames), "excel sheets with", parallel, "workers.")
+    sys.stdout.flush()
 
-        in_header = True
-        for row in sheet.rows:
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=parallel, mp_context=multiprocessing.get_context("fork"))
+    try:
+        futures = []
+        for (idx, sheetname) in enumerate(sheetnames):
+            shard_filename = os.path.join(shard_dir, "sheet_%d.sqlite" % idx)
+            futures.append(pool.submit(__excel_sheet_to_shard, filename, sheetname, shard_filename))
+
+        for (sheetname, future) in zip(sheetnames, futures):
+            (shard_filename, header) = future.result()
+            print("Notice: Reading excel sheet", "\""+sheetname+"\"")
+            if len(header) < 1:
+                continue
 
-            if in_header:
-                in_header = False
+            table_def = __excel_create_table(name, filename, table_name, sheetname, header)
 
-                for cell in row:
-                    cell_value = cell.value
+            cursor = source_conn.cursor()
+            source_conn.commit()
+            __execute(cursor, """ATTACH DATABASE ? AS excel_sheet""", [shard_filename])
+            try:
+                __execute(cursor, """INSERT INTO "%s" (__source_unique_id, %s) SELECT * FROM excel_sheet.rows ORDER BY rowid""" % (
+                    table_def["table_name_in_source"],
+                    ",".join(['"%s"' % column["name"] for column in table_def["columns"]])), [])
+                source_conn.commit()
+            finally:
+                __execute(cursor, """DETACH DATABASE excel_sheet""", [])
+                cursor.close()
+            os.remove(shard_filename)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+# the first row of a sheet is the header, empty cells are skipped
+def __excel_header(row):
+    header = []
+    for cell_value in row:
+        if cell_value is None:
+            continue
+        cell_value = cell_value.strip()
+        if len(cell_value) < 1:
+            continue
 
-                    if cell_value is None:
-                        continue
-                    cell_value = cell_value.strip()
-                    if len(cell_value) < 1:
-                        continue
+        header.append(cell_value)
+    return header
 
-                    header.append(cell_value)
+# returns the bindings for a row of a sheet, after the __source_unique_id
+# one value per header column, missing cells are filled with ""
+def __excel_bindings(row, row_count, header):
+    bindings = [row_count]
 
-                break
+    if len(row) > len(header):
+        # read only sheets pad the rows to the dimension stored in the file,
+        # only warn about cells with a value
+        row = list(row)
+        while len(row) > len(header) and row[-1] is None:
+            row.pop()
 
-        if len(header) < 1:
-            continue
+    for cell_value in row:
+        if len(bindings) == len(header)+1:
+            print("Warning: Too many columns found in row %s, ignoring additional columns." % row_count)
+            break
 
-        qms = ["?"]
-        column_names = []
-        columns = []
+        if cell_value is None:
+            cell_value = ""
+        bindings.append(__value_to_unicode(cell_value))
 
-        for column in header:
-            qms.append("?")
-            column_names.append('"'+column+'"')
-            columns.append({
-                "name": escape_col(column),
-                "type": "TEXT"
-            })
+    if len(bindings) < len(header)+1:
+        # fill with space
+        for i in range(0, len(header)+1-len(bindings)):
+            bindings.append("")
 
-        table_def = {
-            "columns": columns,
-            "primary_keys": []
-        }
+    return bindings
 
-        __create_table_in_source(
-            origin_database_name = os.path.abspath(filename),
-            origin_type = "xlsx",
-            source_name = name,
-            table_def = table_def,
-            origin_table_name = "{}.{}".format(table_name, sheetname)
-        )
+def __excel_create_table(name, filename, table_name, sheetname, header):
+    columns = []
+    for column in header:
+        columns.append({
+            "name": escape_col(column),
+            "type": "TEXT"
+        })
 
-        insert = format_insert(table_def, column_names, qms)
+    table_def = {
+        "columns": columns,
+        "primary_keys": []
+    }
 
-        row_count = 1
-        in_header = True
-        for row in sheet.rows:
+    __create_table_in_source(
+        origin_database_name = os.path.abspath(filename),
+        origin_type = "xlsx",
+        source_name = name,
+        table_def = table_def,
+        origin_table_name = "{}.{}".format(table_name, sheetname)
+    )
 
-            if in_header:
-                in_header = False
-                continue
+    return table_def
 
-            bindings = []
-            bindings.append(row_count)
+def __excel_sheet_to_source(name, filename, table_name, sheetname, rows):
+    header = __excel_header(next(rows, ()))
+    if len(header) < 1:
+        return
 
-            for cell in row:
-                if len(bindings) == len(qms):
-                    print("Warning: Too many columns found in row %s, ignoring additional columns." % row_count)
-                    break
+    table_def = __excel_create_table(name, filename, table_name, sheetname, header)
+    insert = format_insert(table_def, ['"'+column+'"' for column in header], ["?"]*(len(header)+1))
 
-                cell_value = cell.value
-                if cell_value is None:
-                    cell_value = ""
-                bindings.append(__value_to_unicode(cell_value))
+    writer = __bulk_writer()
+    row_count = 1
+    for row in rows:
+        __bulk_write(writer, insert, __excel_bindings(row, row_count, header))
+        row_count += 1
+    __bulk_close(writer)
 
-            if len(bindings) < len(qms):
-                # fill with space
-                for i in range(0, len(qms)-len(bindings)):
-                    bindings.append("")
+# runs in a worker process, writes the bindings of the rows of a sheet into
+# the table "rows" of a new sqlite database
+def __excel_sheet_to_shard(filename, sheetname, shard_filename):
+    wb = openpyxl.load_workbook(filename, read_only=True)
+    rows = wb[sheetname].iter_rows(values_only=True)
+    header = __excel_header(next(rows, ()))
 
-            try:
-                __execute(sql, insert, bindings)
-            except Exception as e:
-                print("Row["+str(row_count)+"]:", row)
-                raise e
+    conn = sqlite3.connect(shard_filename)
+    conn.execute("""CREATE TABLE rows (%s)""" % ",".join(["c%d" % i for i in range(len(header)+1)]))
+    insert = """INSERT INTO rows VALUES (%s)""" % ",".join(["?"]*(len(header)+1))
 
+    if len(header) > 0:
+        batch = []
+        row_count = 1
+        for row in rows:
+            batch.append(__excel_bindings(row, row_count, header))
             row_count += 1
+            if len(batch) >= bulk_buffer_size:
+                conn.executemany(insert, batch)
+                batch = []
+        conn.executemany(insert, batch)
+
+    conn.commit()
+    conn.close()
+    wb.close()
+    return (shard_filename, header)
 
 def __chunks (l, n):
     n = max(1, n)
     return [l[i:i + n] for i in range(0, len(l), n)]
 
+# the open elements are kept on xml_node_stack, each collects the data of
+# its children until end_element, so no lookups in xmldata are needed. the
+# rows for xmldata and "xmldata.transcribed" go through bulk writers.
 def xml_save_node(
     # node_type,
     node_element=None,
@@ -1521,34 +3590,46 @@ def xml_save_node(
     node_data=None
     ):
 
-    global xml_cursor, xml_node_id_stack, xml_node_element_stack
+    global xml_node_id_stack, xml_node_element_stack, xml_next_node_id
 
     if len(xml_node_id_stack) == 0:
         node_parent_id = None
     else:
         node_parent_id = int(xml_node_id_stack[-1])
 
-    node_id_path = ".".join(xml_node_id_stack)
-    node_element_path = "|".join(xml_node_element_stack)
-    node_level = len(xml_node_id_stack)
-
     if node_attrs != None and len(node_attrs) == 0:
         node_attrs = None
 
-    __execute(xml_cursor, """INSERT INTO xmldata (node_parent_id, node_id_path, node_element_path, node_level, node_element, node_attrs, node_data) VALUES (?,?,?,?,?,?,?)""", (node_parent_id, node_id_path, node_element_path, node_level, node_element, node_attrs, node_data)) #node_attr_key, node_attr_value, node_type,
+    node = {
+        "node_id": xml_next_node_id,
+        "node_parent_id": node_parent_id,
+        "node_id_path": ".".join(xml_node_id_stack),
+        "node_element_path": "|".join(xml_node_element_stack),
+        "node_level": len(xml_node_id_stack),
+        "node_element": node_element,
+        "node_attrs": node_attrs,
+        "node_data": node_data,
+        "children": [] # (node_element, node_data) of the children with data
+        }
+    xml_next_node_id += 1
+
+    # print "saving node", node["node_id"], node_parent_id #, node_type
+    return node
 
-    # print "saving node", xml_cursor.lastrowid, node_parent_id #, node_type
-    return xml_cursor.lastrowid
+# writes the xmldata row of a node
+def xml_write_node(node):
+    __bulk_write(xml_writer, """INSERT INTO xmldata (node_id, node_parent_id, node_id_path, node_element_path, node_level, node_element, node_attrs, node_data) VALUES (?,?,?,?,?,?,?,?)""", (node["node_id"], node["node_parent_id"], node["node_id_path"], node["node_element_path"], node["node_level"], node["node_element"], node["node_attrs"], node["node_data"])) #node_attr_key, node_attr_value, node_type,
 
 
 def start_element(name, attrs):
-    global xml_in_cdata, xml_text, xml_depth, xml_node_id_stack, xml_count, xml_node_element_stack
+    global xml_in_cdata, xml_text, xml_depth, xml_node_id_stack, xml_count, xml_node_element_stack, xml_node_stack
 
     # xml_count = xml_count + 1
     # print "\r Elements: ", xml_count,
 
-    node_id = xml_save_node(node_element = name, node_attrs = attrs)
-    xml_node_id_stack.append(str(node_id))
+    node = xml_save_node(node_element = name, node_attrs = attrs)
+    xml_node_stack.append(node)
+    xml_node_id_stack.append(str(node["node_id"]))
     xml_node_element_stack.append(name)
 
     # for attr_key, attr_value in attrs.iteritems():
@@ -1558,98 +3639,102 @@ def start_element(name, attrs):
     xml_depth.append("  ")
 
 def end_element(name):
-    global xml_in_cdata, xml_text, xml_depth, xml_node_id_stack, xml_cursor, xml_node_element_stack, xml_transcribed_counter, xml_filename
+    global xml_in_cdata, xml_text, xml_depth, xml_node_id_stack, xml_node_element_stack, xml_node_stack, xml_transcribed_counter, xml_filename
 
-    node_id = int(xml_node_id_stack[-1])
+    node = xml_node_stack[-1]
 
     if len(xml_text) > 0:
         node_data = "".join(xml_text).strip()
 
         if len(node_data) > 0:
-            # update data in element node
-            __execute(xml_cursor, """UPDATE xmldata SET "node_data" = ? WHERE node_id = ?""", [node_data, node_id])
+            # data of the element node
+            node["node_data"] = node_data
 
         # save_xml_node(node_type = "DATA", node_data = node_data)
         # print "".join(xml_depth), node_data
         del xml_text[:]
 
-    __execute(xml_cursor, "SELECT node_id_path, node_id, node_element_path, node_element, node_attrs FROM xmldata WHERE node_id = %s" % node_id)
-    row = xml_cursor.fetchone()
+    xml_write_node(node)
 
-    node_id_path = row[0]+str(row[1])
-    node_element_path = row[2]+row[3]
-    if row[4] != None:
-        node_attrs = json.loads(row[4])
-    else:
-        node_attrs = None
+    node_id_path = node["node_id_path"]+str(node["node_id"])
+    node_element_path = node["node_element_path"]+node["node_element"]
     data_by_element = {}
 
-    if node_attrs != None:
-        for key, value in node_attrs.items():
+    if node["node_attrs"] != None:
+        for key, value in node["node_attrs"].items():
             # node attributes
             data_by_element["attr:"+key] = value.strip()
 
-    __execute(xml_cursor, "SELECT node_element, node_data, node_id_path, node_element_path FROM xmldata WHERE node_id_path = '%s' ORDER BY node_id" % (".".join(xml_node_id_stack)))
-
-    for row in xml_cursor.fetchall():
-        node_element = row[0]
-        node_data = row[1]
-        if node_data == None:
-            continue
-        node_id_path = row[2]
-        node_element_path = row[3]
+    for (node_element, node_data) in node["children"]:
         if node_element not in data_by_element:
             data_by_element[node_element] = []
         data_by_element[node_element].append(node_data)
 
+    if len(node["children"]) > 0:
+        # the paths of the children, which include this node
+        node_id_path = ".".join(xml_node_id_stack)
+        node_element_path = "|".join(xml_node_element_stack)
+
     if len(data_by_element):
         # print node_id_path, node_element_path
 
         columns = []
-        questionmarks = []
-        data = [node_id_path, node_element_path]
+        data = {
+            "node_id_path": node_id_path,
+            "node_element_path": node_element_path
+            }
 
         for node_element, node_data in data_by_element.items():
             columns.append(node_element)
-            questionmarks.append("?")
             if len(node_data) == 1:
-                data.append(node_data[0])
+                data[node_element] = node_data[0]
             else:
-                data.append(node_data)
+                data[node_element] = node_data
+
+        if xml_transcribed_node_ids:
+            # shards keep the node, the merge renumbers the paths with it
+            xml_require_column("__node_id")
+            data["__node_id"] = node["node_id"]
 
         for node_element in sorted(columns):
             xml_require_column(node_element)
 
-
-        __execute(xml_cursor, """INSERT INTO "xmldata.transcribed" (node_id_path, node_element_path, "%s") VALUES (?,?,%s)""" % ('","'.join(columns), ",".join(questionmarks)), data)
+        # all columns are inserted, so the statement only changes with a new column
+        __bulk_write(xml_transcribed_writer, xml_transcribed_insert, [data.get(column) for column in xml_transcribed_columns])
         # print "INSERT", repr(data)
         xml_transcribed_counter = xml_transcribed_counter + 1
         if xml_transcribed_counter % 10 == 0:
             print("\r ", xml_filename, xml_transcribed_counter, end=' ')
 
+    xml_node_stack.pop()
     xml_node_id_stack.pop()
     xml_node_element_stack.pop()
     xml_depth.pop()
+
+    if len(xml_node_stack) > 0 and node["node_data"] != None:
+        xml_node_stack[-1]["children"].append((node["node_element"], node["node_data"]))
     # print "".join(depth), "/", name
 
 # adds a column to the transcribed table if not exists
 def xml_require_column(name):
-    global xml_transcribed_columns
+    global xml_transcribed_columns, xml_transcribed_insert
 
     if xml_transcribed_columns == None:
         xml_transcribed_columns = []
         __execute(xml_cursor, """PRAGMA table_info("xmldata.transcribed")""")
         for row in xml_cursor.fetchall():
             xml_transcribed_columns.append(row[1])
-
-    if name in xml_transcribed_columns:
+    elif name in xml_transcribed_columns:
         return
 
-    xml_cursor2 = source_conn.cursor()
-    __execute(xml_cursor2, """ALTER TABLE "xmldata.transcribed" ADD COLUMN "%s" TEXT""" % name)
-    xml_transcribed_columns.append(name)
-    # print """Added "xmldata.transcribed"."%s".""" % name
-    xml_cursor2.close()
+    if name not in xml_transcribed_columns:
+        xml_cursor2 = source_conn.cursor()
+        __execute(xml_cursor2, """ALTER TABLE "xmldata.transcribed" ADD COLUMN "%s" TEXT""" % name)
+        xml_transcribed_columns.append(name)
+        # print """Added "xmldata.transcribed"."%s".""" % name
+        xml_cursor2.close()
+
+    xml_transcribed_insert = """INSERT INTO "xmldata.transcribed" ("%s") VALUES (%s)""" % ('","'.join(xml_transcribed_columns), ",".join(["?"]*len(xml_transcribed_columns)))
 
 
 def start_cdata():
@@ -1677,15 +3762,67 @@ def char_data(data):
 #         return
 #     xml_text.append(data.lstrip())
 
+# returns the columns transcribing the xml file adds to
+# "xmldata.transcribed", in the order xml_require_column would add them.
+# this parses the file like xml_to_source, without writing anything.
+def __xml_scan_columns(filename):
+    columns = []
+    known = set()
+    stack = []
+    text = []
+
+    def start(name, attrs):
+        stack.append((name, attrs, []))
+
+    def end(name):
+        (name, attrs, children) = stack.pop()
+
+        node_data = None
+        if len(text) > 0:
+            node_data = "".join(text).strip()
+            del text[:]
+
+        row_columns = set(children)
+        for key in attrs:
+            row_columns.add("attr:"+key)
+
+        for column in sorted(row_columns):
+            if column not in known:
+                known.add(column)
+                columns.append(column)
+
+        # the data of the document element belongs to the file element,
+        # which is not transcribed
+        if len(stack) > 0 and node_data:
+            stack[-1][2].append(name)
+
+    p = xml.parsers.expat.ParserCreate()
+    p.buffer_text = True
+    p.StartElementHandler = start
+    p.EndElementHandler = end
+    p.CharacterDataHandler = text.append
+
+    with open(filename, "rb") as inf:
+        while True:
+            data = inf.read(xml_parse_chunk_size)
+            if not data:
+                break
+            p.Parse(data, False)
+        p.Parse(b"", True)
+
+    return columns
+
 def xml_to_source(
     basedir,         # basedir which is not saved
     filename,        # xml filename
-    name = None      # name in source
+    name = None,     # name in source
+    prescan = False  # scan the file for its columns first and add them at once
     ):
-    global xml_in_cdata, xml_cdata, xml_text, xml_depth, xml_node_id_stack, xml_node_element_stack, xml_cursor, xml_count
+    global xml_in_cdata, xml_cdata, xml_text, xml_depth, xml_node_id_stack, xml_node_element_stack, xml_node_stack, xml_cursor, xml_count
     global source_conn
     global xml_transcribed_columns, xml_transcribed_counter
     global xml_filename
+    global xml_next_node_id, xml_writer, xml_transcribed_writer
 
     xml_transcribed_columns = None
     try:
@@ -1695,15 +3832,28 @@ def xml_to_source(
     xml_cursor = source_conn.cursor()
     xml_count = 0
 
+    # node ids are assigned here, like sqlite would assign the rowids
+    __execute(xml_cursor, """SELECT max(node_id) FROM xmldata""", [])
+    xml_next_node_id = (xml_cursor.fetchone()[0] or 0) + 1
+    xml_writer = __bulk_writer()
+    xml_transcribed_writer = __bulk_writer()
+
         # node_type TEXT NOT NULL,
         # node_attr_key TEXT,
         # node_attr_value TEXT,
 
     # print "Importing XML", repr(filename)
 
+    if prescan:
+        columns = __xml_scan_columns(filename)
+        print("Notice: Found", len(columns), "columns in", filename)
+        for column in columns:
+            xml_require_column(column)
+
     xml_depth = []
     xml_node_id_stack = []
     xml_node_element_stack = []
+    xml_node_stack = []
     xml_text = []
     xml_in_cdata = False
     xml_cdata = []
@@ -1729,95 +3879,486 @@ def xml_to_source(
             "filename": xml_filename
             })
 
-    with open(filename) as inf:
-        p.Parse(inf.read(), True)
-
-    # we don't right an end element here, so we don't have this in our
-    # transcribed table
+    try:
+        # binary, so expat uses the encoding declared in the file
+        with open(filename, "rb") as inf:
+            while True:
+                data = inf.read(xml_parse_chunk_size)
+                if not data:
+                    break
+                p.Parse(data, False)
+            p.Parse(b"", True)
+    finally:
+        # we don't right an end element here, so we don't have this in our
+        # transcribed table. the file element, and all elements left open,
+        # are written to xmldata without their data
+        for node in xml_node_stack:
+            xml_write_node(node)
+
+        __bulk_close(xml_writer)
+        __bulk_close(xml_transcribed_writer)
 
     print("\r ", xml_filename, xml_transcribed_counter)
 
-def merge_source (filename):
+# parses xml files like xml_to_source for one file after the other. with
+# parallel, worker processes parse the files into temporary sqlite databases
+# (shards) with the same xmldata layout. each shard holds a range of the
+# files, the shards are merged in order with renumbered node ids, so the
+# source is the same as parsing the files in this process.
+def xml_files_to_source(
+    basedir,         # basedir which is not saved
+    filenames,       # xml filenames
+    name = None,     # name in source
+    prescan = False, # scan all files for their columns first and add them at once
+    parallel = None  # number of worker processes, None parses in this process
+    ):
     global source_conn
 
-    print("Notice: Merging source:", filename)
-    conn = sqlite3.connect(filename, detect_types=sqlite3.PARSE_DECLTYPES)
-    schema = __sqlite_get_schema(conn=conn)
+    if parallel == None or parallel < 2 or len(filenames) < 2:
+        if prescan:
+            __xml_add_columns(__xml_scan_files_columns(filenames))
+        for filename in filenames:
+            xml_to_source(basedir=basedir, filename=filename, name=name)
+        return
 
-    if "origin" not in schema["tables"]:
-        print("Error: Sqlite Database does not contain table \"origin\", no valid source detected.")
-        sys.exit(1)
+    shards = __xml_shard_files(filenames, parallel * xml_shards_per_worker)
+    shard_dir = tempfile.mkdtemp(prefix="xml_shards_", dir=source_dir)
 
-    sql = conn.cursor()
-    sql2 = conn.cursor()
-    sql3 = source_conn.cursor()
+    print("Notice: Parsing", len(filenames), "XML files in", len(shards), "shards with", parallel, "workers.")
+    sys.stdout.flush()
 
-    select = """SELECT origin_type, origin_database_name, origin_table_name, source_name, source_table_name FROM origin"""
+    # the workers are forked and must not see uncommitted data
+    source_conn.commit()
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=parallel, mp_context=multiprocessing.get_context("fork"))
+    try:
+        # the shards and the source get all columns before the first file
+        columns = None
+        if prescan:
+            columns = __xml_scan_files_columns(filenames, pool)
+            __xml_add_columns(columns)
+            source_conn.commit()
+
+        futures = []
+        for (idx, files) in enumerate(shards):
+            shard_filename = os.path.join(shard_dir, "shard_%d.sqlite" % idx)
+            futures.append(pool.submit(__xml_shard_to_source, shard_filename, basedir, files, name, columns))
+
+        # merge in order, while the workers parse the next shards
+        for (idx, future) in enumerate(futures):
+            shard_filename = future.result()
+            __merge_xml_shard(shard_filename)
+            os.remove(shard_filename)
+            print("Notice: Merged shard", idx+1, "of", len(shards), "("+str(len(shards[idx])), "files)")
+            sys.stdout.flush()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+# returns the columns of all files in the order xml_require_column would add
+# them, files are scanned by the worker processes of pool if given
+def __xml_scan_files_columns(filenames, pool=None):
+    if pool != None:
+        scanned = pool.map(__xml_scan_columns, filenames)
+    else:
+        scanned = map(__xml_scan_columns, filenames)
 
-    __execute(sql, select)
+    columns = []
+    known = set()
+    for file_columns in scanned:
+        for column in file_columns:
+            if column not in known:
+                known.add(column)
+                columns.append(column)
 
-    for row in sql.fetchall():
-        source_name = row[3]
-        source_table_name = row[4]
-        # __merge_table
-        print("Notice: Merging table", source_table_name, ":", row[0], row[1], row[2])
+    print("Notice: Found", len(columns), "columns in", len(filenames), "XML files")
+    return columns
 
-        table_def = schema["tables"][source_name+"."+source_table_name]
+# adds columns to "xmldata.transcribed" before the files are parsed
+def __xml_add_columns(columns):
+    global xml_cursor, xml_transcribed_columns
 
-        __create_table_in_source(
-            origin_database_name = row[1],
-            origin_type = row[0],
-            source_name = source_name,
-            origin_table_name = row[2],
-            table_def = table_def,
-            source_table_name = source_table_name
-            )
+    xml_cursor = source_conn.cursor()
+    xml_transcribed_columns = None
+    for column in columns:
+        xml_require_column(column)
+    xml_cursor.close()
+
+# splits filenames into ranges of about the same size
+def __xml_shard_files(filenames, count):
+    sizes = [os.path.getsize(filename) for filename in filenames]
+    shard_size = float(sum(sizes)) / max(1, count)
+
+    shards = [[]]
+    size = 0
+    for (filename, filesize) in zip(filenames, sizes):
+        if len(shards[-1]) > 0 and size >= shard_size * len(shards):
+            shards.append([])
+        shards[-1].append(filename)
+        size += filesize
+    return shards
+
+# runs in a worker process
+def __xml_shard_to_source(shard_filename, basedir, filenames, name, columns):
+    global source_conn, xml_transcribed_node_ids
+
+    # the connection of the parent process is not used here
+    source_conn = None
+    xml_transcribed_node_ids = True
+
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        prepare_source(shard_filename, init=True)
+
+    if columns != None:
+        __xml_add_columns(columns)
+
+    for filename in filenames:
+        xml_to_source(basedir=basedir, filename=filename, name=name)
+
+    source_conn.commit()
+    source_conn.close()
+    source_conn = None
+    return shard_filename
+
+# shifts the node ids in a node_id_path of xmldata by offset
+def __xml_shift_path(path, offset):
+    if path == "":
+        return path
+    return ".".join([str(int(node_id) + offset) for node_id in path.split(".")])
+
+def __merge_xml_shard(shard_filename):
+    global source_conn
 
-        short_schema = {
-            "tables": {}
-            }
-        short_schema["tables"] = {}
-        short_schema["tables"][source_table_name] = table_def
+    cursor = source_conn.cursor()
+    __execute(cursor, """SELECT max(node_id) FROM xmldata""", [])
+    offset = cursor.fetchone()[0] or 0
 
-        __copy_data_to_source(conn, short_schema)
+    source_conn.commit()
+    source_conn.create_function("xml_shift_path", 2, __xml_shift_path)
+    __execute(cursor, """ATTACH DATABASE ? AS xml_shard""", [shard_filename])
+    try:
+        columns = [row[1] for row in cursor.execute("""PRAGMA main.table_info("xmldata.transcribed")""")]
+        shard_columns = [row[1] for row in cursor.execute("""PRAGMA xml_shard.table_info("xmldata.transcribed")""")]
+        data_columns = []
+        for column in shard_columns:
+            if column == "__node_id" or column == "node_id_path":
+                continue
+            if column not in columns:
+                __execute(cursor, """ALTER TABLE main."xmldata.transcribed" ADD COLUMN "%s" TEXT""" % column)
+                columns.append(column)
+            data_columns.append(column)
+
+        cursor.execute("BEGIN")
+        __execute(cursor, """
+INSERT INTO main.xmldata
+    (node_id, node_parent_id, node_id_path, node_element_path, node_level, node_element, node_attrs, node_data)
+SELECT
+    node_id + :offset, node_parent_id + :offset, xml_shift_path(node_id_path, :offset), node_element_path, node_level, node_element, node_attrs, node_data
+FROM xml_shard.xmldata ORDER BY node_id""", {"offset": offset})
+
+        # the path of a row is the path of its node and the node id, which
+        # is joined without "." if the node has no children with data
+        __execute(cursor, """
+INSERT INTO main."xmldata.transcribed" (node_id_path, %s)
+SELECT
+    CASE WHEN t.node_id_path = x.node_id_path || '.' || x.node_id
+        THEN xml_shift_path(x.node_id_path, :offset) || '.' || (x.node_id + :offset)
+        ELSE xml_shift_path(x.node_id_path, :offset) || (x.node_id + :offset)
+    END, %s
+FROM xml_shard."xmldata.transcribed" t JOIN xml_shard.xmldata x ON (x.node_id = t.__node_id)
+ORDER BY t.rowid""" % (
+            ",".join(['"%s"' % column for column in data_columns]),
+            ",".join(['t."%s"' % column for column in data_columns])),
+            {"offset": offset})
+        source_conn.commit()
+    except:
+        source_conn.rollback()
+        raise
+    finally:
+        __execute(cursor, """DETACH DATABASE xml_shard""", [])
+        cursor.close()
+
+# record mode: each element matching record_path becomes one row of a table,
+# the values are taken from the record with the column paths.
+#
+# record_path is a "/" separated list of tags. "/export/objects/object" has
+# to match from the document element on, "objects/object" matches the end of
+# the path of an element.
+#
+# the column path is an ElementTree path relative to the record ("title",
+# "meta/author", ".//keyword"), "." is the record itself. a path ending in
+# "@name" ("@id", "meta/@lang") takes the attribute of the matching elements.
+# elements give their text with the text of their children, stripped. if a
+# path matches more than once, the values are stored as json list.
+#
+# only the current record is kept in memory.
+def xml_records_to_source (
+    name,             # name in source
+    filename,         # xml filename
+    record_path,      # path of the record elements
+    columns,          # columns array with "name", "path" and optional "type" (default "TEXT") as keys
+    table_name=None   # table name in source, defaults to filename's basename
+    ):
+    global source_conn
+    writer = __bulk_writer()
 
-        # now we need to copy filestore and file
-        select = """SELECT filestore_id, unique_id, original_filename, mimetype, filesize, url, filename, data FROM filestore WHERE filestore_id IN (SELECT filestore_id FROM "file" WHERE source_name='%s' and source_table_name='%s')""" % (source_name, source_table_name)
-        __execute(sql2, select)
+    print("Notice: Reading XML records", "\""+record_path+"\"", "from", "\""+filename+"\"")
 
-        insert = "INSERT INTO filestore (unique_id, original_filename, mimetype, filesize, url, filename, data) VALUES (?,?,?,?,?,?,?)"
+    record_tags = record_path.strip("/").split("/")
+    record_absolute = record_path.startswith("/")
 
-        filestore_id_map = {}
+    if table_name == None:
+        table_name = os.path.basename(filename)
+
+    qms = ["?"]
+    column_names = []
+    table_columns = []
+    column_paths = []
+    for column in columns:
+        qms.append("?")
+        column_names.append('"'+column["name"]+'"')
+        table_columns.append({"name": escape_col(column["name"]), "type": column.get("type", "TEXT")})
+
+        # split off the attribute
+        path = column["path"]
+        attr = None
+        if "@" in path.rsplit("/", 1)[-1]:
+            (path, attr) = path.rsplit("@", 1)
+            path = path.rstrip("/")
+            if path == "":
+                path = "."
+        column_paths.append((path, attr))
+
+    table_def = {
+        "columns": table_columns,
+        "primary_keys": []
+        }
+
+    __create_table_in_source(
+        origin_database_name = os.path.abspath(filename),
+        origin_type = "xml_records",
+        source_name = name,
+        table_def = table_def,
+        origin_table_name = table_name
+        )
+
+    insert = format_insert(table_def, column_names, qms)
+
+    # open elements, tags of the open elements
+    stack = []
+    tags = []
+    # level of the record in stack, None outside of a record
+    record_level = None
+    row_count = 0
+
+    try:
+        for (event, node) in ET.iterparse(filename, events=("start", "end")):
+            if event == "start":
+                stack.append(node)
+                tags.append(node.tag)
+
+                if record_level == None and __xml_record_match(tags, record_tags, record_absolute):
+                    record_level = len(stack)
+                continue
+
+            if record_level != None and len(stack) > record_level:
+                # inside of a record, keep the element until the record ends
+                stack.pop()
+                tags.pop()
+                continue
+
+            if record_level == len(stack):
+                row_count += 1
+                bindings = [row_count]
+                for (path, attr) in column_paths:
+                    bindings.append(__xml_record_value(node, path, attr))
+                __bulk_write(writer, insert, bindings)
+                record_level = None
+
+                if row_count % 1000 == 0:
+                    print("\r ", table_name, row_count, end=' ')
+
+            stack.pop()
+            tags.pop()
+            if len(stack) > 0:
+                # finished elements are removed, the open elements keep at
+                # most the element just parsed
+                stack[-1].remove(node)
+            node.clear()
+
+    except ET.ParseError as e:
+        print("Error: could not parse XML from",filename+":",e)
+    finally:
+        __bulk_close(writer)
+
+    print("\r ", table_name, row_count)
+    print("Notice: Inserted",row_count,"rows into table",table_def["table_name_in_source"])
+
+def __xml_record_match(tags, record_tags, record_absolute):
+    if record_absolute and len(tags) != len(record_tags):
+        return False
+    return tags[-len(record_tags):] == record_tags
+
+def __xml_record_value(node, path, attr):
+    values = []
+    for match in node.iterfind(path):
+        if attr != None:
+            value = match.get(attr)
+        else:
+            value = "".join(match.itertext()).strip()
+        if value:
+            values.append(value)
+
+    if len(values) == 0:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return values
+
+# merges the tables of another source. the source is attached, so tables,
+# filestore and file are copied with INSERT ... SELECT inside of sqlite.
+# filestore rows are matched by unique_id, rows already in this source are
+# used instead of a copy.
+def merge_source (filename):
+    global source_conn
 
-        for _row in sql2.fetchall():
-            filestore_id = _row[0]
+    print("Notice: Merging source:", filename)
+    conn = sqlite3.connect(filename, detect_types=sqlite3.PARSE_DECLTYPES)
+    schema = __sqlite_get_schema(conn=conn)
 
-            bindings = []
-            for idx in range(1,8):
-                bindings.append(_row[idx])
+    if "origin" not in schema["tables"]:
+        print("Error: Sqlite Database does not contain table \"origin\", no valid source detected.")
+        sys.exit(1)
 
-            __execute(sql3, insert, bindings)
-            filestore_id_map[filestore_id] = sql3.lastrowid
+    sql = conn.cursor()
+    select = """SELECT origin_type, origin_database_name, origin_table_name, source_name, source_table_name FROM origin"""
+    __execute(sql, select)
+    origins = sql.fetchall()
+    sql.close()
+    conn.close()
 
-        # delete files from the same source and an earlier merge
-        __execute(sql3, """DELETE FROM file WHERE source_name='%s' AND source_table_name='%s' """ %(source_name, source_table_name))
+    has_files = "file" in schema["tables"] and "filestore" in schema["tables"]
+    merge_dir = os.path.dirname(os.path.abspath(filename))
 
-        select = """SELECT filestore_id, source_name, source_table_name, source_column_name, source_unique_id, origin_url, eas_id, eas_root_id, file_version FROM "file" WHERE source_name='%s' and source_table_name='%s'""" % (source_name, source_table_name)
+    source_conn.commit()
+    cursor = source_conn.cursor()
+    __execute(cursor, """ATTACH DATABASE ? AS merge_source""", [filename])
+    try:
+        if has_files:
+            filestore_select = __merge_filestore_select(cursor, merge_dir)
+            __execute(cursor, """CREATE TEMP TABLE IF NOT EXISTS merge_filestore_map (merge_id INTEGER PRIMARY KEY, filestore_id INTEGER NOT NULL)""", [])
+
+        for row in origins:
+            source_name = row[3]
+            source_table_name = row[4]
+            # __merge_table
+            print("Notice: Merging table", source_table_name, ":", row[0], row[1], row[2])
+
+            table_def = schema["tables"][source_name+"."+source_table_name]
+
+            __create_table_in_source(
+                origin_database_name = row[1],
+                origin_type = row[0],
+                source_name = source_name,
+                origin_table_name = row[2],
+                table_def = table_def,
+                source_table_name = source_table_name
+                )
 
-        insert = "INSERT INTO file (filestore_id, source_name, source_table_name, source_column_name, source_unique_id, origin_url, eas_id, eas_root_id, file_version) VALUES (?,?,?,?,?,?,?,?,?)"
+            column_names = ",".join(['"%s"' % column["name"] for column in table_def["columns"]])
+            __execute(cursor, """INSERT INTO main."%s" (%s) SELECT %s FROM merge_source."%s" """ % (
+                table_def["table_name_in_source"], column_names, column_names, table_def["table_name"]), [])
+            print("Notice:", table_def["table_name_in_source"], cursor.rowcount, "rows.")
 
-        __execute(sql2, select)
-        files = 0
-        for _row in sql2.fetchall():
-            bindings = []
-            bindings.append(filestore_id_map[_row[0]])
-            for idx in range(1,9):
-                bindings.append(_row[idx])
-            __execute(sql3, insert, bindings)
-            files += 1
+            if has_files:
+                files = __merge_files(cursor, filestore_select, source_name, source_table_name)
+                if files > 0:
+                    print("Notice:", files, "files copied.")
 
-        if files > 0:
-            print("Notice:", files, "files copied.")
+            source_conn.commit()
+    except:
+        source_conn.rollback()
+        raise
+    finally:
+        __execute(cursor, """DETACH DATABASE merge_source""", [])
+        cursor.close()
+
+# returns the SELECT for the filestore columns of the attached source. data
+# in files of the other source is linked into filestore_dir, or read into
+# data if this source has no external filestore.
+def __merge_filestore_select(cursor, merge_dir):
+    columns = [row[1] for row in cursor.execute("""PRAGMA merge_source.table_info(filestore)""")]
+
+    data_hash = "f.data_hash" if "data_hash" in columns else "NULL"
+    if "data_path" not in columns:
+        return "f.unique_id, f.original_filename, f.mimetype, f.filesize, f.url, f.filename, f.data, %s, NULL" % data_hash
+
+    def merge_data(data, data_path):
+        if data_path == None or filestore_dir != None:
+            return data
+        with open(os.path.join(merge_dir, data_path), "rb") as fl:
+            return fl.read()
+
+    def merge_data_path(data_path):
+        if data_path == None or filestore_dir == None:
+            return None
+
+        merge_path = os.path.join(merge_dir, data_path)
+        data_hash = os.path.basename(merge_path)
+        path = os.path.join(filestore_dir, data_hash[0:2], data_hash[2:4], data_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(merge_path, path)
+            except OSError:
+                fd, tmp_filename = tempfile.mkstemp(prefix=".tmp-", dir=filestore_dir)
+                os.close(fd)
+                shutil.copyfile(merge_path, tmp_filename)
+                os.replace(tmp_filename, path)
+        return __filestore_data_path(path)
+
+    source_conn.create_function("merge_data", 2, merge_data)
+    source_conn.create_function("merge_data_path", 1, merge_data_path)
+
+    return "f.unique_id, f.original_filename, f.mimetype, f.filesize, f.url, f.filename, merge_data(f.data, f.data_path), %s, merge_data_path(f.data_path)" % data_hash
+
+# copies the file rows of a table of the attached source and the filestore
+# rows they use, returns the number of file rows copied
+def __merge_files(cursor, filestore_select, source_name, source_table_name):
+    table = [source_name, source_table_name]
+
+    __execute(cursor, """
+INSERT INTO main.filestore (unique_id, original_filename, mimetype, filesize, url, filename, data, data_hash, data_path)
+SELECT %s FROM merge_source.filestore f
+WHERE f.filestore_id IN (SELECT filestore_id FROM merge_source."file" WHERE source_name=? AND source_table_name=?)
+AND NOT EXISTS (SELECT 1 FROM main.filestore m WHERE m.unique_id = f.unique_id)
+ORDER BY f.filestore_id""" % filestore_select, table)
+
+    # filestore ids of the attached source to the ids in this source
+    __execute(cursor, """DELETE FROM merge_filestore_map""", [])
+    __execute(cursor, """
+INSERT INTO merge_filestore_map (merge_id, filestore_id)
+SELECT f.filestore_id, m.filestore_id FROM merge_source.filestore f JOIN main.filestore m ON (m.unique_id = f.unique_id)
+WHERE f.filestore_id IN (SELECT filestore_id FROM merge_source."file" WHERE source_name=? AND source_table_name=?)""", table)
+
+    # delete files from the same source and an earlier merge
+    __execute(cursor, """DELETE FROM main."file" WHERE source_name=? AND source_table_name=?""", table)
+
+    __execute(cursor, """
+INSERT INTO main."file" (filestore_id, source_name, source_table_name, source_column_name, source_unique_id, origin_url, eas_id, eas_root_id, file_version)
+SELECT map.filestore_id, f.source_name, f.source_table_name, f.source_column_name, f.source_unique_id, f.origin_url, f.eas_id, f.eas_root_id, f.file_version
+FROM merge_source."file" f JOIN merge_filestore_map map ON (map.merge_id = f.filestore_id)
+WHERE f.source_name=? AND f.source_table_name=?
+AND NOT EXISTS (SELECT 1 FROM main."file" m WHERE m.eas_id = f.eas_id AND m.file_version = f.file_version)
+ORDER BY f.file_id""", table)
+    files = cursor.rowcount
+
+    # like eas_to_source, an eas file version is only stored once
+    __execute(cursor, """SELECT count(*) FROM merge_source."file" WHERE source_name=? AND source_table_name=?""", table)
+    skipped = cursor.fetchone()[0] - files
+    if skipped > 0:
+        print("Notice:", skipped, "files skipped, their eas versions are used by other tables.")
+
+    return files
 
 # import an sql schema that is saved in multiple xml file
 # each file represents a table
@@ -1827,7 +4368,8 @@ def merge_source (filename):
 def adhh_xml_to_source(
     basedir,         # basedir which is not saved
     filename,        # xml filename
-    name = None      # name in source
+    name = None,     # name in source
+    prescan = False  # scan the file for its columns first and add them at once
     ):
     # global xml_in_cdata, xml_cdata, xml_text, xml_depth, xml_node_id_stack, xml_node_element_stack, xml_cursor, xml_count
     global source_conn
@@ -1841,9 +4383,11 @@ def adhh_xml_to_source(
     def escape_value(value):
         return value.replace("\"", "\"\"")
 
+    # the items are parsed one by one, see __adhh_items
     root = None
     try:
-        root = ET.XML(open(basedir + "/" + os.path.basename(filename)).read())
+        events = ET.iterparse(basedir + "/" + os.path.basename(filename), events=("start", "end"))
+        (event, root) = next(events)
     except Exception as e:
         print("Error: could not parse XML from",filename+":",e)
         return
@@ -1878,8 +4422,68 @@ def adhh_xml_to_source(
                 VALUES (?,?,?,?,?)"""
         __execute(adhh_cursor, cmd, [os.path.abspath(filename), "adhh", table_name, table_name, table_name])
 
+    insert_columns = []
+    if prescan:
+        try:
+            insert_columns = __adhh_scan_columns(basedir + "/" + os.path.basename(filename))
+        except ET.ParseError as e:
+            print("Error: could not parse XML from",filename+":",e)
+            return
+
+        print("Notice: Found", len(insert_columns), "columns in", filename)
+        for column_name in insert_columns:
+            if column_name not in column_names:
+                column_names.append(column_name)
+                cmd = "ALTER TABLE \"" + table_name + "\" ADD COLUMN \"" + column_name + "\" TEXT"
+                __execute(adhh_cursor, cmd)
+
+    writer = __bulk_writer()
+    try:
+        inserted_rows = __adhh_insert_items(adhh_cursor, writer, __adhh_items(events, root), table_name, column_names, insert_columns)
+    except ET.ParseError as e:
+        print("Error: could not parse XML from",filename+":",e)
+        inserted_rows = None
+    finally:
+        __bulk_close(writer)
+
+    if inserted_rows != None:
+        print("Notice: Inserted",inserted_rows,"rows into table",table_name)
+
+# yields the complete child nodes of root from iterparse events and removes
+# them from root afterwards, so only one item is kept in memory
+def __adhh_items(events, root):
+    depth = 1
+    for (event, node) in events:
+        if event == "start":
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 1:
+            yield node
+            del root[:]
+
+# returns the column names used by the items of an ADHH file, in order of
+# appearance
+def __adhh_scan_columns(filename):
+    columns = []
+    events = ET.iterparse(filename, events=("start", "end"))
+    (event, root) = next(events)
+    for item_node in __adhh_items(events, root):
+        for sub_node in item_node:
+            if sub_node.tag == "column" and "name" in sub_node.attrib and sub_node.attrib["name"] not in columns:
+                columns.append(sub_node.attrib["name"])
+    return columns
+
+def __adhh_insert_items(adhh_cursor, writer, items, table_name, column_names, insert_columns=[]):
+    # columns used by the items of this file, in order of appearance, so the
+    # insert statement only changes when a new column shows up. with a
+    # prescan all columns are known up front.
+    insert_columns = list(insert_columns)
+    insert = None
+
     inserted_rows = 0
-    for i, item_node in enumerate(root):
+    for item_node in items:
         if item_node.tag != "item":
             print("Error: invalid node",item_node.tag,"(expected 'item')")
             return
@@ -1902,134 +4506,241 @@ def adhh_xml_to_source(
                 # print "SQL:",cmd
                 __execute(adhh_cursor, cmd)
 
+            if sub_node.attrib["name"] not in insert_columns:
+                insert_columns.append(sub_node.attrib["name"])
+                insert = None
+
         # insert the values of this <item> node to the table row
-        v = []
-        for c in column_names:
-            if c in values:
-                v.append((c, values[c]))
-
-        if len(v) > 0:
-            cmd = "INSERT INTO \"" + table_name + "\" ("
-            cmd += ", ".join([vt[0] for vt in v])
-            cmd += ") VALUES ("
-            cmd += ", ".join(["?" for vt in v])
-            cmd += ")"
-            # print "SQL:",cmd
-            __execute(adhh_cursor, cmd, [vt[1] for vt in v])
+        if len(values) > 0:
+            if insert == None:
+                insert = "INSERT INTO \"" + table_name + "\" ("
+                insert += ", ".join(["\"" + c + "\"" for c in insert_columns])
+                insert += ") VALUES ("
+                insert += ", ".join(["?" for c in insert_columns])
+                insert += ")"
+            __bulk_write(writer, insert, [values.get(c) for c in insert_columns])
             inserted_rows += 1
 
-    print("Notice: Inserted",inserted_rows,"rows into table",table_name)
+    return inserted_rows
 
-def dump_mysql(output, encode_blob_method="hex", blob_chunk_size=50000):
+# dumps the source as mysql statements. rows are read with fetchmany and
+# written as INSERTs with as many rows as fit into packet_size. blobs longer
+# than blob_chunk_size are inserted with their first chunk and completed by
+# UPDATEs, which need a primary key or __source_unique_id.
+#
+# with parallel, output is a directory and worker processes write one file
+# per table.
+def dump_mysql(output, encode_blob_method="hex", blob_chunk_size=50000, packet_size=None, parallel=None):
     global source_conn
     schema = __sqlite_get_schema(source_conn)
-    sql = source_conn.cursor()
+
+    if encode_blob_method not in ("hex", "base64"):
+        raise Exception("Unknown encode_blob_method: "+encode_blob_method)
+
+    if packet_size == None:
+        packet_size = mysql_packet_size
+
+    tables = schema["tables"]
+
+    if parallel != None and parallel > 1 and output != "-":
+        os.makedirs(output, exist_ok=True)
+        # the workers read with their own connection
+        source_conn.commit()
+
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=parallel, mp_context=multiprocessing.get_context("fork"))
+        try:
+            futures = []
+            for (table_name, tb) in list(tables.items()):
+                filename = os.path.join(output, table_name.replace("/", "_")+".sql")
+                futures.append(pool.submit(__dump_mysql_file, schema["database"], filename, table_name, tb, encode_blob_method, blob_chunk_size, packet_size))
+
+            for future in futures:
+                (filename, rows) = future.result()
+                print("Notice: Dumped", rows, "rows to", filename)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        print("Notice: Dumped current sqlite to mysql files in: ", output)
+        return
+
     if output=="-":
-        out = sys.stdout
+        out = sys.stdout.buffer
     else:
-        out = open(output, "wb")
+        out = open(output, "wb", buffering=blob_chunk_size*20)
 
-    tables = schema["tables"]
+    out.write(mysql_dump_header.encode("utf8"))
+    for (table_name, tb) in list(tables.items()):
+        __dump_mysql_table(source_conn, out, table_name, tb, encode_blob_method, blob_chunk_size, packet_size)
+    out.write(mysql_dump_footer.encode("utf8"))
+
+    if output=="-":
+        out.flush()
+        print("Notice: Dumped current sqlite to mysql.", file=sys.stderr)
+    else:
+        out.close()
+        print("Notice: Dumped current sqlite to mysql file: ", output)
+
+mysql_dump_header = """SET sql_mode="NO_BACKSLASH_ESCAPES,ANSI_QUOTES";\nBEGIN;\n"""
+mysql_dump_footer = """COMMIT;\n"""
+
+sqlite_to_mysql = {
+    "TEXT": "TEXT",
+    "integer": "BIGINT",
+    "INTEGER": "BIGINT",
+    "REAL": "DOUBLE",
+    "DATETIME": "TIMESTAMP",
+    "BLOB": "LONGBLOB"
+    }
+
+# runs in a worker process of dump_mysql
+def __dump_mysql_file(database, filename, table_name, tb, encode_blob_method, blob_chunk_size, packet_size):
+    conn = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES)
+    with open(filename, "wb", buffering=blob_chunk_size*20) as out:
+        out.write(mysql_dump_header.encode("utf8"))
+        rows = __dump_mysql_table(conn, out, table_name, tb, encode_blob_method, blob_chunk_size, packet_size)
+        out.write(mysql_dump_footer.encode("utf8"))
+    conn.close()
+    return (filename, rows)
+
+def __mysql_value(item):
+    if item == None:
+        return "null"
+    if isinstance(item, str):
+        return "'"+(item.replace("'","''"))+"'"
+    if isinstance(item, bool):
+        return str(int(item))
+    if isinstance(item, (int, decimal.Decimal)):
+        return str(item)
+    if isinstance(item, float):
+        return repr(item)
+    if isinstance(item, (datetime.datetime, datetime.date)):
+        return "'"+str(item)+"'"
+    if isinstance(item, (list, dict)):
+        return "'"+(json.dumps(item).replace("'","''"))+"'"
+    return None
+
+# writes the CREATE TABLE and the rows of a table, returns the number of rows
+def __dump_mysql_table(conn, out, table_name, tb, encode_blob_method, blob_chunk_size, packet_size):
     def write_out(s):
         out.write(s.encode("utf8"))
 
-    write_out("SET sql_mode=\"NO_BACKSLASH_ESCAPES,ANSI_QUOTES\";\n")
-    write_out("BEGIN;\n")
+    if encode_blob_method == "base64": # requires mysql >= 5.6.1
+        encode = lambda data: base64.b64encode(data).decode("ascii")
+        decode = "FROM_BASE64"
+        # whole groups of 3 bytes, so each chunk decodes on its own
+        raw_chunk_size = max(3, blob_chunk_size // 4 * 3)
+    else:
+        encode = lambda data: data.hex()
+        decode = "UNHEX"
+        raw_chunk_size = max(1, blob_chunk_size // 2)
 
-    sqlite_to_mysql = {
-        "TEXT": "TEXT",
-        "integer": "BIGINT",
-        "INTEGER": "BIGINT",
-        "DATETIME": "TIMESTAMP",
-        "BLOB": "LONGBLOB"
-        }
+    column_names = []
+    cmd = "CREATE TABLE \""+table_name+"\" (\n"
+    for idx, column in enumerate(tb["columns"]):
+        if idx > 0:
+            cmd += ",\n"
 
-    for (table_name, tb) in list(tables.items()):
-        qms = []
-        column_names = []
-        cmd = "CREATE TABLE \""+table_name+"\" (\n"
-        for idx, column in enumerate(tb["columns"]):
-            if idx > 0:
-                cmd += ",\n"
-
-            _type = column["type"]
-            if _type in sqlite_to_mysql:
-                __type = sqlite_to_mysql[_type]
-            else:
-                __type = "TEXT"
+        _type = column["type"]
+        if _type in sqlite_to_mysql:
+            __type = sqlite_to_mysql[_type]
+        else:
+            __type = "TEXT"
+
+        cmd += "   \""+column["name"]+"\" "+__type
+        column_names.append("\""+column["name"]+"\"")
+
+    cmd += "\n);\n"
+    write_out(cmd)
+
+    # columns identifying a row for the UPDATEs of chunked blobs
+    key_columns = []
+    for pk in tb["primary_keys"]:
+        for (cidx, column) in enumerate(tb["columns"]):
+            if column["name"] == pk:
+                key_columns.append((cidx, pk))
+    if len(key_columns) == 0:
+        for (cidx, column) in enumerate(tb["columns"]):
+            if column["name"] == "__source_unique_id":
+                key_columns.append((cidx, column["name"]))
 
+    insert = ("INSERT INTO \""+table_name+"\" VALUES ").encode("utf8")
 
-            cmd += "   \""+column["name"]+"\" "+__type
-            column_names.append("\""+column["name"]+"\"")
+    # the encoded rows of the current INSERT and the UPDATEs to write after it
+    statement = []
+    statement_size = 0
+    more_cmds = []
 
-        cmd += "\n);\n"
-        write_out(cmd)
+    def flush():
+        if len(statement) == 0:
+            return
+        out.write(insert+b",".join(statement)+b";\n")
+        for more_cmd in more_cmds:
+            write_out(more_cmd)
+        del statement[:]
+        del more_cmds[:]
 
-        select = """SELECT %s FROM "%s" """ % (",".join(column_names), table_name)
+    sql = conn.cursor()
+    __execute(sql, """SELECT %s FROM "%s" """ % (",".join(column_names), table_name), [])
+    row_count = 0
+    while True:
+        rows = sql.fetchmany(stream_itersize)
+        if len(rows) == 0:
+            break
 
-        __execute(sql, select)
-        for row in sql.fetchall():
+        for row in rows:
             values = []
-            more_cmds = []
+            row_cmds = []
             where_clause = None
 
             for (idx, item) in enumerate(row):
-                if item == None:
+                value = __mysql_value(item)
+                if value != None:
+                    values.append(value)
+                    continue
+
+                if not isinstance(item, (bytes, bytearray, memoryview)):
+                    print("Warning: Unable to insert item", table_name, type(item))
                     values.append("null")
-                elif isinstance(item, str):
-                    values.append("'"+(item.replace("'","''"))+"'")
-                elif isinstance(item, int):
-                    values.append(str(item))
-                elif isinstance(item, buffer):
-
-                    # SPLIT BLOB into handlable chunks for mysql
-                    # mysql has a server limit of 1MB for query packets
-                    if encode_blob_method == "base64": # requires mysql >= 5.6.1
-                        s = str(item).encode("base64")
-                        decode = "FROM_BASE64"
-                    elif encode_blob_method == "hex":
-                        s = str(item).encode("hex")
-                        decode = "UNHEX"
+                    continue
+
+                # SPLIT BLOB into handlable chunks for mysql
+                # mysql has a server limit of 1MB for query packets
+                item = bytes(item)
+                if len(item) <= raw_chunk_size:
+                    values.append(decode+"('"+encode(item)+"')")
+                    continue
+
+                if where_clause == None:
+                    ands = []
+                    for (cidx, cn) in key_columns:
+                        if row[cidx] == None:
+                            ands = []
+                            break
+                        ands.append("\""+cn+"\"="+__mysql_value(row[cidx]))
+                    if len(ands) == 0:
+                        where_clause = ""
                     else:
-                        raise Exception("Unknown encode_blob_method: "+encode_blob_method)
-
-                    if len(s) < blob_chunk_size:
-                        values.append(decode+"('"+s+"')")
-                        continue
-
-                    if where_clause == None:
-                        ands = []
-                        for pk in tb["primary_keys"]:
-                            value = None
-                            for (cidx, column) in enumerate(tb["columns"]):
-                                if column["name"] == pk:
-                                    value = row[cidx]
-                                    if value == None:
-                                        raise Exception("Primary Key Data not found for "+pk)
-                                    ands.append("\""+pk+"\"="+__value_to_unicode(value))
                         where_clause = "WHERE "+" AND ".join(ands)
 
-                    cn = tb["columns"][idx]["name"]
-                    for (cidx, chunk) in enumerate(__chunks(s, blob_chunk_size)):
-                        if cidx == 0:
-                            values.append(decode+"('"+chunk+"')")
-                        else:
-                            more_cmds.append("UPDATE \""+table_name+"\" SET \""+cn+"\" = \""+cn+"\"+"+decode+"('"+chunk+"') "+where_clause+";\n")
-                elif isinstance(item, int):
-                    values.append(str(item))
-                elif isinstance(item, datetime.datetime):
-                    values.append(str(item))
-                else:
-                    print("Warning: Unable to insert item", table_name, type(item))
-
-            cmd = "INSERT INTO \""+table_name+"\" VALUES ("+",".join(values)+");\n"
-            write_out(cmd)
-            if len(more_cmds) > 0:
-                for more_cmd in more_cmds:
-                    write_out(more_cmd)
+                if where_clause == "":
+                    print("Warning: No key for blob of", len(item), "bytes in", table_name+", inserting it at once.")
+                    values.append(decode+"('"+encode(item)+"')")
+                    continue
 
+                cn = tb["columns"][idx]["name"]
+                values.append(decode+"('"+encode(item[:raw_chunk_size])+"')")
+                for offset in range(raw_chunk_size, len(item), raw_chunk_size):
+                    row_cmds.append("UPDATE \""+table_name+"\" SET \""+cn+"\" = CONCAT(\""+cn+"\", "+decode+"('"+encode(item[offset:offset+raw_chunk_size])+"')) "+where_clause+";\n")
+
+            value = ("("+",".join(values)+")").encode("utf8")
+            if statement_size + len(value) + 1 > packet_size - len(insert):
+                flush()
+                statement_size = 0
+            statement.append(value)
+            statement_size += len(value) + 1
+            more_cmds.extend(row_cmds)
+            row_count += 1
 
-    write_out("COMMIT;\n")
-    if out!=sys.stdout:
-        out.close()
-    print("Notice: Dumped current sqlite to mysql file: ", output)
+    flush()
+    sql.close()
+    return row_count
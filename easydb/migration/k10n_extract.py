@@ -7,6 +7,7 @@
 
 import sqlite3
 import os
+import re
 import sys
 import decimal
 import json
@@ -326,7 +327,9 @@ def prepare_source(
                 filesize INTEGER,
                 url TEXT,
                 filename TEXT,
-                data BLOB
+                data BLOB,
+                data_hash TEXT,
+                data_path TEXT
             )
         """,
         )
@@ -411,6 +414,9 @@ DELIMITER_VAL = '\x1f'  # Unit separator (Information Separator One)
 DELIMITER_FALLBACK = '$'
 NEWLINE = '\n'
 
+# rows of k10plus_data inserted with one executemany
+k10plus_batch_size = 10000
+
 KNOWN_SUB_FIELDS = [
     '0',
     '2',
@@ -460,6 +466,17 @@ KNOWN_SUB_FIELDS = [
 ]
 
 
+# a part of a line starts with an optional unit separator and runs up to the next unit
+# separator or up to a "$" that is followed by a known sub field ("$" is dropped)
+__known_sub_fields = '[' + re.escape(''.join(KNOWN_SUB_FIELDS)) + ']'
+PART_RE = re.compile(
+    '({val}?[^{val}$]*(?:\\$(?!{sub})[^{val}$]*)*)({val}|\\$(?={sub})|\\Z)'.format(
+        val=DELIMITER_VAL, sub=__known_sub_fields
+    ),
+    re.DOTALL,
+)
+
+
 def parse_line(line):
 
     if line[0] == DELIMITER_OBJ:
@@ -473,32 +490,8 @@ def parse_line(line):
     while line[-1] == NEWLINE:
         line = line[:-1]
 
-    res = []
-    part = ''
-    i = 0
-    for c in line:
-        if c == DELIMITER_VAL:
-            if part != '':
-                res.append(part.strip())
-                part = ''
-                i += 1
-                continue
-
-        if c == DELIMITER_FALLBACK:
-            if i < len(line) - 1:
-                if line[i + 1] in KNOWN_SUB_FIELDS:
-                    res.append(part.strip())
-                    part = ''
-                    i += 1
-                    continue
-
-        i += 1
-        part += c
-
-    if part != '':
-        res.append(part.strip())
-
-    return res
+    # an empty part is only kept if a delimiter ends it
+    return [part.strip() for part, delimiter in PART_RE.findall(line) if part or delimiter]
 
 
 def group_line(parsed):
@@ -593,6 +586,13 @@ def k10plus_to_source(
             (basename, 0, item_id_offset + 1),
         )
 
+    insert = """
+        INSERT INTO k10plus_data
+        (item_id, feld, unterfeld, wert)
+        VALUES (?,?,?,?)
+    """
+    rows = []
+
     try:
 
         with open(filename, 'r') as f:
@@ -637,18 +637,14 @@ def k10plus_to_source(
                 group = group_line(parsed)
                 for unterfeld in group:
                     for wert in group[unterfeld]:
-                        # insert a new entry in the data table, add an uplink to the item
-                        __execute(
-                            cur,
-                            """
-                            INSERT INTO k10plus_data
-                            (item_id, feld, unterfeld, wert)
-                            VALUES (?,?,?,?)
-                        """,
-                            (item_id, feld, unterfeld, wert),
-                        )
+                        # new entry for the data table, with an uplink to the item
+                        rows.append((item_id, feld, unterfeld, wert))
                         total_rows += 1
 
+                if len(rows) >= k10plus_batch_size:
+                    cur.executemany(insert, rows)
+                    rows = []
+
     except KeyboardInterrupt:
         interrupt = True
         close_connection = True
@@ -657,6 +653,9 @@ def k10plus_to_source(
         close_connection = True
         raise e
 
+    # write the rows still buffered
+    cur.executemany(insert, rows)
+
     # update offset and last item id in source table
     __execute(
         cur,
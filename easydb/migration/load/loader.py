@@ -687,14 +687,24 @@ class Loader(object):
                 asset_file = self.tmp_asset_file
                 logger.info('load asset for {0}:{1}:{2} from {3}:{4}'.format(self.objecttype.name, column_def.name, object_id, source_type, row['source']))
                 if source_type == 'data':
-                    sql = 'select data from filestore where filestore.filestore_id = ?'
+                    if self.source.external_filestore:
+                        sql = 'select data, data_path from filestore where filestore.filestore_id = ?'
+                    else:
+                        sql = 'select data, null as data_path from filestore where filestore.filestore_id = ?'
                     data_rows = self.source.execute(sql, row['source'])
                     if len(data_rows) == 0:
                         logger.error('asset not found in filestore')
                         continue
                     data_row = next(data_rows)
-                    with open(self.tmp_asset_file, 'wb') as output_file:
-                        output_file.write(data_row['data'])
+                    if data_row['data_path'] is not None:
+                        # stored outside of the source, upload straight from disk
+                        asset_file = self.source.get_filestore_path(data_row['data_path'])
+                        if not os.path.isfile(asset_file):
+                            logger.error('asset not found in filestore: {0}'.format(asset_file))
+                            continue
+                    else:
+                        with open(self.tmp_asset_file, 'wb') as output_file:
+                            output_file.write(data_row['data'])
                 elif source_type == 'url':
                     r = requests.get(row['source'], stream=True, verify=self.verify_ssl)
                     if r.status_code != 200:
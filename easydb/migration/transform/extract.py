@@ -194,8 +194,12 @@ def process_assets(db, source, asset_column, file_table_id, source_id, stop_on_e
     try:
         logger.debug('process_assets {0} for {1}'.format(asset_column, source_id))
         error_str = 'fetching rows'
+        if source.external_filestore:
+            has_data = '(fs.data is not null or fs.data_path is not null)'
+        else:
+            has_data = 'fs.data is not null'
         rows = source.execute(
-            SQL_get_asset_info,
+            SQL_get_asset_info.format(has_data),
             asset_column.schema,
             asset_column.table,
             asset_column.column,
@@ -267,7 +271,7 @@ select
 	fs.original_filename as "original_filename",
         fs.url is not null as "has_url",
         fs.filename is not null as "has_filename",
-        fs.data is not null as "has_data",
+        {0} as "has_data",
         fs.url as url,
         fs.filename as filename
 from file f
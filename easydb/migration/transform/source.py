@@ -6,6 +6,7 @@
 '''
 
 import logging
+import os
 import re
 
 import easydb.repository.base
@@ -45,10 +46,21 @@ class Source(object):
         self.table_map = {}
         for origin in self.metadata.origins:
             self.table_map[origin.get_name()] = origin.get_source_table()
+        # file data written to disk by extract, data_path is relative to the directory
+        self.external_filestore = self.has_column('filestore', 'data_path')
 
     def is_open(self):
         return self.db is not None and self.db.is_open()
 
+    def has_column(self, table_name, column_name):
+        for table_def in self.db.get_schema_def().tables:
+            if table_def.name == table_name:
+                return column_name in [column_def.name for column_def in table_def.columns]
+        return False
+
+    def get_filestore_path(self, data_path):
+        return os.path.join(self.directory, data_path)
+
     @check_open
     def close(self):
         self.db.close()